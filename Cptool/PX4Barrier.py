@@ -0,0 +1,149 @@
+import asyncio
+import math
+import time
+
+from pymavlink import mavutil
+
+
+class PX4Barrier:
+    """
+    由真实信号驱动的阶段屏障。
+
+    对每个实例运行一个检查协程：返回True表示就绪，返回False表示确定失败，
+    未返回则继续等待。就绪实例达到 quorum 比例、所有检查结束或超时后放行。
+    """
+
+    def __init__(self, name, timeout, quorum=1.0):
+        """
+        :param name: 屏障名称，用于输出
+        :param timeout: 超时时间（秒）
+        :param quorum: 放行所需的就绪实例比例（0-1）
+        """
+        self.name = name
+        self.timeout = timeout
+        self.quorum = quorum
+
+    @classmethod
+    def from_config(cls, name, config):
+        """
+        从config.yaml的barriers配置中创建屏障。
+
+        :param name: 屏障名称，对应 barriers 下的键
+        :param config: 完整的配置字典
+        """
+        barrier_config = config["barriers"][name]
+        return cls(name, barrier_config["timeout"], barrier_config["quorum"])
+
+    async def wait(self, links, check):
+        """
+        等待一组链路通过检查。
+
+        :param links: PX4MavLink链路列表
+        :param check: 检查协程函数 check(link)
+        :return: 已就绪的实例编号列表
+        """
+        start_time = time.time()
+        need = math.ceil(self.quorum * len(links))
+        tasks = {asyncio.ensure_future(check(link)): link.instance_num for link in links}
+        ready = []
+        pending = set(tasks)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        try:
+            while pending and len(ready) < need:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None and task.result():
+                        ready.append(tasks[task])
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        print(f"屏障[{self.name}]: {len(ready)}/{len(links)} 个实例就绪，耗时 {time.time() - start_time:.2f} 秒")
+        return sorted(ready)
+
+    def wait_links(self, link_pool, instances, check):
+        """
+        在共享链路的事件循环中等待一组实例通过检查。
+
+        :param link_pool: PX4LinkPool对象
+        :param instances: PX4实例编号列表
+        :param check: 检查协程函数 check(link)
+        :return: 已就绪的实例编号列表
+        """
+        async def wait():
+            links = await link_pool.open(instances)
+            return await self.wait(links, check)
+
+        return link_pool.run(wait())
+
+
+async def heartbeat_ready(link):
+    """收到PX4心跳即就绪"""
+    while not await link.wait_heartbeat(1.0):
+        pass
+    return True
+
+
+async def home_position_ready(link, request_interval=1.0):
+    """
+    心跳就绪且HOME_POSITION有效（PX4在EKF全局位置有效后才设置home）即就绪。
+
+    :param link: PX4MavLink链路
+    :param request_interval: 请求HOME_POSITION的间隔（秒）
+    """
+    await heartbeat_ready(link)
+    while True:
+        link.mav.command_long_send(
+            link.target_system,
+            link.target_component,
+            mavutil.mavlink.MAV_CMD_REQUEST_MESSAGE,
+            0,
+            mavutil.mavlink.MAVLINK_MSG_ID_HOME_POSITION,
+            0, 0, 0, 0, 0, 0
+        )
+        msg = await link.recv_match(type="HOME_POSITION", timeout=request_interval)
+        if msg is not None:
+            return True
+
+
+def is_mission_mode(heartbeat):
+    """心跳中的custom_mode是否为AUTO.MISSION，且已解锁"""
+    _, main_mode, sub_mode = mavutil.px4_map["MISSION"]
+    custom_main_mode = (heartbeat.custom_mode >> 16) & 0xFF
+    custom_sub_mode = (heartbeat.custom_mode >> 24) & 0xFF
+    armed = heartbeat.base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED
+    return bool(armed) and custom_main_mode == main_mode and custom_sub_mode == sub_mode
+
+
+def is_armed(heartbeat):
+    return bool(heartbeat.base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED)
+
+
+async def landed_disarmed(link):
+    """心跳确认已上锁（PX4降落后自动上锁）即就绪"""
+    await link.recv_match(
+        type="HEARTBEAT",
+        condition=lambda msg: msg.autopilot != mavutil.mavlink.MAV_AUTOPILOT_INVALID and not is_armed(msg),
+    )
+    return True
+
+
+async def mission_active(link, min_altitude):
+    """
+    心跳确认已进入MISSION模式并解锁，且飞行高度达到min_altitude即就绪。
+
+    :param link: PX4MavLink链路
+    :param min_altitude: 开始评分前的最低飞行高度（米）
+    """
+    await link.recv_match(
+        type="HEARTBEAT",
+        condition=lambda msg: msg.autopilot != mavutil.mavlink.MAV_AUTOPILOT_INVALID and is_mission_mode(msg),
+    )
+    await link.recv_match(type="LOCAL_POSITION_NED", condition=lambda msg: -msg.z >= min_altitude)
+    return True
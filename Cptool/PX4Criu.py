@@ -1,18 +1,29 @@
 import argparse
+import asyncio
 import time
 import os
 import subprocess
-import multiprocessing
 import psutil
 import yaml
 import re
 
 import pickle
+import json
 
 
+from PX4Barrier import home_position_ready, mission_active
+from PX4CriuScheduler import PX4CriuJob, PX4CriuScheduler, dir_size
+from PX4LinkPool import PX4LinkPool
 from PX4Mission import PX4Mission
+from PX4MissionLibrary import PX4MissionLibrary
 from PX4Param import PX4Param
+from PX4Registry import PX4Registry
 from PX4SihSim import PX4SihSim  
+from PX4SnapshotStore import PX4SnapshotStore
+
+
+# px4实例按实例编号偏移的本地UDP端口（见px4-rc.mavlink），黄金镜像克隆时需要重映射
+PX4_LOCAL_PORT_BASES = [18570, 20000, 24000]
 
 
 class PX4Criu:
@@ -29,90 +40,274 @@ class PX4Criu:
         self.is_daemon=config["simulation"]["daemon"]
         self.base_port = config["simulation"]["connect_port_2"]
         self.param_files = config["param_files"]["px4"]
+        # criu任务调度器，限制同时执行的dump/restore数量
+        self.scheduler = PX4CriuScheduler.from_config(config)
+        # 增量检查点：每个实例保留一条pre-dump链，dump只写入链上最后一次之后变化的页面
+        self.incremental = config.get("criu", {}).get("incremental", False)
+        self.max_chain = config.get("criu", {}).get("max_chain", 8)
+        # 生成检查点时稳定飞行期间的pre-dump次数
+        self.pre_dump_count = config.get("criu", {}).get("pre_dump_count", 2)
+        # 实例编号 → 链上已有的pre-dump层数
+        self.chain_levels = {}
+        # 并行生成检查点的流水线配置
+        self.checkpoint_config = config["checkpoint"]
+        # 任务上传的超时与重试
+        self.mission_config = config.get("mission", {})
+        # 任务库，各实例的任务航点只生成一次
+        self.missionLibrary = PX4MissionLibrary.from_config(config)
+        # 延迟页面恢复：进程先恢复运行，内存页由lazy-pages守护进程按缺页读回
+        self.lazy_pages = config.get("criu", {}).get("lazy_pages", False)
+        # 实例编号 → lazy-pages守护进程
+        self.lazy_daemons = {}
+        # 镜像和工作目录的硬链接快照
+        self.snapshotStore = PX4SnapshotStore()
+        # 实例编号 → PID/端口/工作目录的登记表，启动和恢复时填写
+        self.registry = PX4Registry(self.base_port)
         #初始化px4工具类
-        self.px4SihSim = PX4SihSim(self.px4_working_dir,self.px4_build_dir,self.sim_speed,self.instance_count,self.is_daemon)
-        self.px4Mission = PX4Mission(self.instance_count,self.base_port)
+        self.px4SihSim = PX4SihSim(self.px4_working_dir,self.px4_build_dir,self.sim_speed,self.instance_count,self.is_daemon,self.registry,config.get("launcher"))
+        self.px4Mission = PX4Mission(self.instance_count,self.base_port,library=self.missionLibrary,**self.mission_config)
 
         # 初始化用于存储模拟实例进程的列表
         self.processes = []
 
     def find_px4_sih_pid(self):
-        # 存储 PID 和实例号的字典
-        pid_dict = {}
-
-        cmd = "ps -aux | grep 'px4_sitl_default/bin/px4'"
-        output = subprocess.check_output(cmd, shell=True, text=True)
-        # print(output)
+        """
+        从登记表中查找各实例的PID。
 
-        # 将输出按行分割
-        lines = output.strip().split('\n')
-        if not lines:
-            print("未找到px4进程")
-            return None
-        
-        # 处理每一行
-        for line in lines:
-            # 提取 PID (第2个字段)
-            fields = line.split()
-            pid = int(fields[1])
-            
-            # 使用正则表达式提取实例号
-            instance_match = re.search(r'-i\s+(\d+)', line)
-            if instance_match:
-                instance_num = int(instance_match.group(1))
-                pid_dict[instance_num] = pid
-        # 按实例号排序并创建 PID 数组
+        :return: 按实例编号排列的PID列表，未登记的实例为0
+        """
+        pid_dict = self.registry.pids()
         pids = [0] * (max(pid_dict.keys(), default=-1) + 1)
         for instance_num, pid in pid_dict.items():
             pids[instance_num] = pid
-            
         return pids
     
-    def dump_single_px4_proecss(self,instance_num,pid):
-        img_dir = f"{self.px4_working_dir}/criu_img_dir/px4_{instance_num}_img"
-        os.system(f"rm -rf {img_dir}")
-        os.system(f"mkdir -p {img_dir}")
+    def _img_dir(self, instance_num):
+        return f"{self.px4_working_dir}/criu_img_dir/px4_{instance_num}_img"
+
+    def _chain_dir(self, instance_num):
+        return f"{self.px4_working_dir}/criu_img_dir/px4_{instance_num}_chain"
+
+    def dump_job(self, instance_num, pid, img_dir=None, prev_images_dir=None, leave_running=False):
+        """
+        创建一个dump任务，每次执行前清空镜像目录。
+
+        :param prev_images_dir: 父镜像目录（绝对路径），给出时只写入父镜像之后变化的页面
+        :param leave_running: dump后进程继续运行（中间检查点），否则criu结束进程
+        """
+        img_dir = img_dir or self._img_dir(instance_num)
         # os.system(f"sudo criu dump -D {img_dir} -j --tcp-established --file-locks -t {pid}")
         cmd = ["sudo","criu","dump","-D",img_dir,"-j","--tcp-established","--file-locks","-t",f"{pid}"]
-        subprocess.Popen(cmd)
-        # return process.pid
+        if leave_running:
+            cmd += ["--leave-running"]
+        if prev_images_dir is not None:
+            # criu要求父镜像目录为相对于镜像目录的路径
+            cmd += ["--track-mem", "--prev-images-dir", os.path.relpath(prev_images_dir, img_dir)]
+        return PX4CriuJob("dump", instance_num, cmd, img_dir,
+                          prepare=lambda: os.system(f"sudo rm -rf {img_dir} && mkdir -p {img_dir}"))
+
+    def restore_job(self, instance_num, golden_num=None):
+        """
+        创建一个restore任务。恢复完成后criu退出（--restore-detached），恢复出的进程PID写入pidfile。
+
+        :param golden_num: 镜像由黄金实例生成时为黄金实例编号
+        """
+        img_dir = self._img_dir(instance_num)
+        # os.system(f"sudo criu restore -D {img_dir} -j --tcp-established")
+        cmd = ["sudo","criu","restore","-D",img_dir,"-j","--tcp-established","--restore-detached",
+               "--pidfile",self._restore_pidfile(instance_num)]
+        if golden_num is not None:
+            cmd += self._replace_path_args(golden_num, instance_num)
+        lazy_pages = self.lazy_pages
+
+        def prepare():
+            # pidfile以O_EXCL创建，重试前需要删除
+            os.system(f"sudo rm -f {self._restore_pidfile(instance_num)}")
+            if lazy_pages:
+                self._start_lazy_pages(instance_num)
+
+        if lazy_pages:
+            cmd += ["--lazy-pages"]
+        return PX4CriuJob("restore", instance_num, cmd, img_dir, prepare=prepare)
+
+    def _start_lazy_pages(self, instance_num, timeout=2.0):
+        """
+        启动一个实例的lazy-pages守护进程，等待其在镜像目录中创建套接字。
+        守护进程在所有页面读回后自行退出。
+        """
+        self.stop_lazy_pages([instance_num])
+        img_dir = self._img_dir(instance_num)
+        socket_file = f"{img_dir}/lazy-pages.socket"
+        os.system(f"sudo rm -f {socket_file}")
+        self.lazy_daemons[instance_num] = subprocess.Popen(
+            ["sudo","criu","lazy-pages","-D",img_dir,"-o","lazy-pages.log"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.time() + timeout
+        while not os.path.exists(socket_file) and time.time() < deadline:
+            time.sleep(0.01)
+
+    def stop_lazy_pages(self, instances=None):
+        """
+        结束lazy-pages守护进程（进程被杀掉后守护进程不会自行退出）。
+
+        :param instances: 实例编号列表，None表示全部
+        """
+        if instances is None:
+            instances = list(self.lazy_daemons)
+        for instance_num in instances:
+            daemon = self.lazy_daemons.pop(instance_num, None)
+            if daemon is not None and daemon.poll() is None:
+                os.system(f"sudo pkill -P {daemon.pid} 2>/dev/null")
+                daemon.wait()
+
+    def pre_dump_job(self, instance_num, pid):
+        """
+        创建一个pre-dump任务，在实例的pre-dump链上追加一层。
+        第0层是完整的基础镜像，之后每层只包含上一层之后变化的页面，pre-dump期间进程继续运行。
+        """
+        level = self.chain_levels.get(instance_num, 0)
+        chain_dir = self._chain_dir(instance_num)
+        img_dir = f"{chain_dir}/{level}"
+        cmd = ["sudo","criu","pre-dump","-D",img_dir,"--track-mem","-t",f"{pid}"]
+        if level > 0:
+            cmd += ["--prev-images-dir", f"../{level - 1}"]
+            prepare = lambda: os.system(f"sudo rm -rf {img_dir} && mkdir -p {img_dir}")
+        else:
+            # 新链从基础镜像开始，清空旧链
+            prepare = lambda: os.system(f"sudo rm -rf {chain_dir} && mkdir -p {img_dir}")
+        return PX4CriuJob("pre-dump", instance_num, cmd, img_dir, prepare=prepare)
+
+    def next_pre_dump_job(self, instance_num, pid):
+        """创建链上下一层的pre-dump任务，链达到max_chain层时重新生成基础镜像"""
+        if self.chain_levels.get(instance_num, 0) >= self.max_chain:
+            self.chain_levels[instance_num] = 0
+        return self.pre_dump_job(instance_num, pid)
 
+    def finish_pre_dump_job(self, job):
+        """按pre-dump任务的结果更新链的层数"""
+        if job.ok:
+            self.chain_levels[job.instance_num] = self.chain_levels.get(job.instance_num, 0) + 1
+        else:
+            # 链已损坏，下次从基础镜像重新开始
+            self.chain_levels.pop(job.instance_num, None)
 
-    def dump_multiple_px4_proecss(self,instances,pids):
-        args = zip(instances,pids)
-        with multiprocessing.Pool() as pool:
-            pool.starmap(self.dump_single_px4_proecss, args)
+    def pre_dump_multiple_px4_proecss(self, instances, pids):
+        """
+        在一组实例的pre-dump链上各追加一层。飞行期间定期调用，使最终的dump只写入少量页面。
+
+        :return: 执行完的任务列表
+        """
+        jobs = self.scheduler.run(self.next_pre_dump_job(instance_num, pid) for instance_num, pid in zip(instances, pids))
+        for job in jobs:
+            self.finish_pre_dump_job(job)
+        return jobs
+
+    def incremental_dump_job(self, instance_num, pid, leave_running=False):
+        """
+        以pre-dump链的最后一层为父镜像创建dump任务，没有链时为完整dump。
+        dump会重置内存跟踪，之后链不能再作为父镜像，因此创建任务后丢弃链的层数。
+        """
+        level = self.chain_levels.pop(instance_num, 0)
+        prev_images_dir = f"{self._chain_dir(instance_num)}/{level - 1}" if level > 0 else None
+        return self.dump_job(instance_num, pid, prev_images_dir=prev_images_dir, leave_running=leave_running)
+
+    def chain_size(self, instance_num):
+        """实例检查点占用的总字节数：pre-dump链的所有层加上最终镜像"""
+        return dir_size(self._chain_dir(instance_num)) + dir_size(self._img_dir(instance_num))
+
+    def dump_incremental_px4_proecss(self, instances, pids, leave_running=False):
+        """
+        增量检查点：以飞行期间pre_dump_multiple_px4_proecss生成的链的最后一层为父镜像dump，
+        最终镜像只包含最后一次pre-dump之后变化的页面，恢复时通过parent链接读取其余页面。
+        没有pre-dump链的实例直接完整dump，不额外生成基础镜像。
+
+        :param leave_running: dump后进程继续运行
+        :return: dump任务列表
+        """
+        jobs = self.scheduler.run(
+            self.incremental_dump_job(instance_num, pid, leave_running) for instance_num, pid in zip(instances, pids)
+        )
+        self.report_chain_size(jobs)
+        return jobs
+
+    def report_chain_size(self, jobs):
+        """输出增量dump新写入的大小和整条链（含所有pre-dump层）的总大小"""
+        done = [job for job in jobs if job.ok]
+        if not done:
+            return
+        new_size = sum(job.image_size for job in done)
+        total_size = sum(self.chain_size(job.instance_num) for job in done)
+        print(f"增量dump: 最终镜像 {new_size / 2**20:.1f} MB，含pre-dump链共 {total_size / 2**20:.1f} MB")
+
+    def dump_single_px4_proecss(self,instance_num,pid,leave_running=False):
+        if self.incremental:
+            return self.dump_incremental_px4_proecss([instance_num], [pid], leave_running)[0]
+        return self.scheduler.run([self.dump_job(instance_num, pid, leave_running=leave_running)])[0]
+
+
+    def dump_multiple_px4_proecss(self,instances,pids,leave_running=False):
+        if self.incremental:
+            return self.dump_incremental_px4_proecss(instances, pids, leave_running)
+        return self.scheduler.run(
+            self.dump_job(instance_num, pid, leave_running=leave_running) for instance_num, pid in zip(instances, pids)
+        )
 
     def restore_single_px4_proecss(self,instance_num):
-        img_dir = f"{self.px4_working_dir}/criu_img_dir/px4_{instance_num}_img"
-        # os.system(f"sudo criu restore -D {img_dir} -j --tcp-established")
-        cmd = ["sudo","criu","restore","-D",img_dir,"-j","--tcp-established"]
-        subprocess.Popen(cmd)
-        # return process.pid  
-
-    def restore_multiple_px4_proecss(self,instances):
-        # 使用 Process 来并行执行进程
-        with multiprocessing.Pool() as pool:
-            pool.map(self.restore_single_px4_proecss, instances)
-        time.sleep(5)
-        pids = px4Criu.find_px4_sih_pid()
+        job = self.scheduler.run([self.restore_job(instance_num)])[0]
+        self.chain_levels.pop(instance_num, None)
+        if job.ok:
+            self.read_restore_pid(instance_num)
+        return job
+
+    def _restore_pidfile(self, instance_num):
+        return f"{self._img_dir(instance_num)}/restore.pid"
+
+    def read_restore_pid(self, instance_num):
+        """
+        读取criu restore --pidfile 写入的PID，并登记到登记表。
+
+        :return: 恢复出的px4进程PID，读取失败返回None
+        """
+        try:
+            pid = int(subprocess.check_output(["sudo", "cat", self._restore_pidfile(instance_num)], text=True))
+        except (subprocess.CalledProcessError, ValueError):
+            return None
+        self.registry.register(
+            instance_num, pid, f"{self.px4_working_dir}/instance_dir/instance_{instance_num}", source="restore"
+        )
+        return pid
+
+    def restore_multiple_px4_proecss(self,instances,golden_num=None):
+        """
+        由调度器并发恢复一组实例，并把恢复出的PID登记到登记表。
+
+        :param golden_num: 镜像由黄金实例生成时为黄金实例编号
+        :return: 按实例编号排列的PID列表
+        """
+        jobs = self.scheduler.run(self.restore_job(instance_num, golden_num) for instance_num in instances)
+        for job in jobs:
+            # 恢复失败的实例不保留旧PID
+            self.registry.unregister(job.instance_num)
+            # 恢复出的进程没有内存跟踪信息，pre-dump链需要从基础镜像重新开始
+            self.chain_levels.pop(job.instance_num, None)
+            if job.ok:
+                self.read_restore_pid(job.instance_num)
+        pids = self.find_px4_sih_pid()
         print(pids)
         return pids
 
 
 
     def recover_criu_imgs(self):
-        os.system(f"rm -rf {self.px4_working_dir}/")
-        os.system(f"cp -r {self.criu_imgs_dir}/ {self.px4_working_dir}/")
-        time.sleep(1)
-        print("已恢复criu imgs和px4工作目录")
+        # 只恢复发生变化的文件，镜像文件通过硬链接共享
+        stats = self.snapshotStore.recover(self.criu_imgs_dir, self.px4_working_dir)
+        print(f"已恢复criu imgs和px4工作目录 {stats}")
 
 
     def save_criu_imgs(self):
-        os.system(f"rm -rf {self.criu_imgs_dir}")
-        os.system(f"cp -r {self.px4_working_dir}/ {self.criu_imgs_dir}")
-        time.sleep(1)
-        print("已保存criu imgs和px4工作目录")
+        stats = self.snapshotStore.save(self.px4_working_dir, self.criu_imgs_dir)
+        print(f"已保存criu imgs和px4工作目录 {stats}")
 
         
 
@@ -129,7 +324,73 @@ class PX4Criu:
         print(f"成功保存px4实例{instance_num}")
         # return pid
 
+    async def _build_checkpoint_async(self, instance_num, link_pool, px4Mission, boot_slots, active_slots):
+        """
+        单个实例的检查点流水线：启动 → 等待home位置有效 → 上传并启动任务 →
+        爬升到min_altitude后再飞行steady_time（仿真时间）→ 提交dump。
+
+        :param boot_slots: 限制同时启动中的实例数（每批启动的数量）
+        :param active_slots: 限制同时存在（启动到dump完成）的实例数
+        :return: 是否保存成功
+        """
+        checkpoint_config = self.checkpoint_config
+        async with active_slots:
+            async with boot_slots:
+                # 先绑定端口再启动，不错过第一个心跳
+                link = (await link_pool.open([instance_num]))[0]
+                link.reset()
+                pid = self.px4SihSim.start_single_sih_sitl(instance_num)
+                try:
+                    await asyncio.wait_for(home_position_ready(link), checkpoint_config["launch_timeout"])
+                except asyncio.TimeoutError:
+                    print(f"实例{instance_num}启动超时")
+                    self.registry.kill([instance_num])
+                    return False
+
+            if not await px4Mission.start_single_mission_async(link):
+                print(f"实例{instance_num}任务上传失败")
+                self.registry.kill([instance_num])
+                return False
+            try:
+                await asyncio.wait_for(
+                    mission_active(link, checkpoint_config["min_altitude"]), checkpoint_config["mission_timeout"]
+                )
+            except asyncio.TimeoutError:
+                print(f"实例{instance_num}未进入稳定飞行")
+                self.registry.kill([instance_num])
+                return False
+            steady_time = checkpoint_config["steady_time"] / self.sim_speed
+            pre_dumps = self.pre_dump_count if self.incremental else 0
+            for _ in range(pre_dumps):
+                # 稳定飞行期间定期pre-dump，最终dump只需写入最后一次pre-dump之后变化的页面
+                await asyncio.sleep(steady_time / (pre_dumps + 1))
+                job = await asyncio.wrap_future(self.scheduler.submit(self.next_pre_dump_job(instance_num, pid)))
+                self.finish_pre_dump_job(job)
+            await asyncio.sleep(steady_time / (pre_dumps + 1))
+
+            # dump在调度器线程池中执行，与其他实例的飞行阶段重叠
+            if self.incremental:
+                job = self.incremental_dump_job(instance_num, pid)
+            else:
+                job = self.dump_job(instance_num, pid)
+            job = await asyncio.wrap_future(self.scheduler.submit(job))
+            self.registry.unregister(instance_num)
+            return job.ok
+
+    async def _make_multiple_px4_sih_checkpoint_async(self, instances, link_pool, px4Mission):
+        boot_slots = asyncio.Semaphore(self.checkpoint_config["batch_size"])
+        active_slots = asyncio.Semaphore(self.checkpoint_config["max_active"] or os.cpu_count())
+        return await asyncio.gather(*(
+            self._build_checkpoint_async(instance_num, link_pool, px4Mission, boot_slots, active_slots)
+            for instance_num in instances
+        ))
+
     def make_multiple_px4_sih_checkpoint(self,instance_count):
+        """
+        并行流水线生成instance_count个检查点：分批启动，按真实信号推进各阶段，
+        每个实例达到稳定飞行后立即dump。同时启动的实例数由batch_size限制，
+        同时存在的实例数由max_active（默认CPU核数）限制，dump并发数由criu调度器限制。
+        """
         os.system(f"rm -rf {self.px4_working_dir}/")
         os.system(f"rm -rf {self.criu_imgs_dir}")
         os.system("killall px4")
@@ -137,16 +398,199 @@ class PX4Criu:
         # with multiprocessing.Pool() as pool:
         #     pool.map(self.make_single_px4_sih_checkpoint, range(instance_count))
         # time.sleep(10)
-        for i in range(instance_count):
-            self.make_single_px4_sih_checkpoint(i)
-        
-        
+        start_time = time.perf_counter()
+        link_pool = PX4LinkPool(self.base_port)
+        px4Mission = PX4Mission(instance_count, self.base_port, link_pool, library=self.missionLibrary, **self.mission_config)
+        try:
+            results = link_pool.run(
+                self._make_multiple_px4_sih_checkpoint_async(list(range(instance_count)), link_pool, px4Mission)
+            )
+        finally:
+            link_pool.close()
+        failed = [instance_num for instance_num, ok in enumerate(results) if not ok]
+        print(f"已保存{instance_count - len(failed)}/{instance_count}个检查点，耗时 {time.perf_counter() - start_time:.2f} 秒")
+        if failed:
+            print("以下实例保存失败:", failed)
+        if self.incremental:
+            total_size = sum(self.chain_size(instance_num) for instance_num, ok in enumerate(results) if ok)
+            print(f"检查点含pre-dump链共 {total_size / 2**20:.1f} MB")
+        return failed
+
+    def _find_child_pid(self, pid, name):
+        """
+        在pid的子孙进程中查找名为name的进程。
+
+        :return: 进程PID，找不到返回None
+        """
+        for child in psutil.Process(pid).children(recursive=True):
+            if child.name() == name:
+                return child.pid
+        return None
+
+    def _start_golden_px4_sih(self, golden_num):
+        """
+        在独立的PID命名空间中启动黄金实例，使同一镜像可以恢复多份而不产生PID冲突。
+
+        :return: 黄金实例px4进程在宿主机上的PID
+        """
+        wrapper_pid = self.px4SihSim.start_single_sih_sitl(
+            golden_num, command_prefix=["sudo", "-E", "unshare", "--pid", "--fork"]
+        )
+        for _ in range(50):
+            pid = self._find_child_pid(wrapper_pid, "px4")
+            if pid is not None:
+                self.registry.register(
+                    golden_num, pid, f"{self.px4_working_dir}/instance_dir/instance_{golden_num}"
+                )
+                return pid
+            time.sleep(0.1)
+        raise RuntimeError(f"未找到黄金实例{golden_num}的px4进程")
+
+    def _remap_criu_img(self, golden_img_dir, img_dir, golden_num, instance_num):
+        """
+        由黄金镜像生成实例镜像：页面等镜像文件硬链接共享，只重写files.img中的套接字。
+        UDP端口按实例编号偏移，px4的unix套接字路径改为本实例编号。
+        """
+        offset = instance_num - golden_num
+        golden_ports = {port_base + golden_num for port_base in PX4_LOCAL_PORT_BASES}
+        os.system(f"sudo rm -rf {img_dir} && sudo cp -al {golden_img_dir} {img_dir}")
+
+        output = subprocess.check_output(["sudo", "crit", "decode", "-i", f"{golden_img_dir}/files.img"], text=True)
+        files = json.loads(output)
+
+        def remap(entry):
+            if isinstance(entry, dict):
+                # inet套接字
+                if "src_port" in entry and entry["src_port"] in golden_ports:
+                    entry["src_port"] += offset
+                # unix套接字，例如 /tmp/px4-sock-0
+                if "backlog" in entry and isinstance(entry.get("name"), str):
+                    entry["name"] = re.sub(rf"-{golden_num}$", f"-{instance_num}", entry["name"])
+                for value in entry.values():
+                    remap(value)
+            elif isinstance(entry, list):
+                for value in entry:
+                    remap(value)
+
+        remap(files)
+        # 硬链接的files.img先删除再写入，避免改动黄金镜像
+        os.system(f"sudo rm -f {img_dir}/files.img")
+        subprocess.run(
+            ["sudo", "crit", "encode", "-o", f"{img_dir}/files.img"], input=json.dumps(files), text=True, check=True
+        )
+
+    def _replace_path_args(self, golden_num, instance_num):
+        """
+        生成把黄金实例打开的文件映射到本实例文件的 --replace-path 参数，
+        包括工作目录下的所有文件和px4的锁文件。
+        """
+        golden_dir = f"{self.px4_working_dir}/instance_dir/instance_{golden_num}"
+        instance_dir = f"{self.px4_working_dir}/instance_dir/instance_{instance_num}"
+        args = []
+        for root, _, files in os.walk(golden_dir):
+            for file_name in files:
+                golden_file = os.path.join(root, file_name)
+                instance_file = os.path.join(instance_dir, os.path.relpath(golden_file, golden_dir))
+                args += ["--replace-path", f"{golden_file}={instance_file}"]
+        lock_file = f"/tmp/px4_lock-{instance_num}"
+        open(lock_file, "a").close()
+        args += ["--replace-path", f"/tmp/px4_lock-{golden_num}={lock_file}"]
+        return args
+
+    def restore_golden_px4_proecss(self, instance_num, golden_num=0):
+        """从按实例重映射后的黄金镜像恢复一个实例"""
+        job = self.scheduler.run([self.restore_job(instance_num, golden_num)])[0]
+        if job.ok:
+            self.read_restore_pid(instance_num)
+        return job
 
+    def make_golden_px4_sih_checkpoint(self, instance_count, golden_num=0, flight_time=20):
+        """
+        只飞一次：黄金实例飞到稳定状态后保存镜像，再为每个实例生成重映射后的镜像和工作目录，
+        创建instance_count个检查点只需要一次飞行。
+
+        恢复后的实例仍保留黄金实例的MAVLink系统ID，并继续向黄金实例的远程端口发送，
+        需要由地面站向 24000+i 发送一次心跳（PX4LinkPool.announce）后才会改为向 26000+i 发送。
+        系统ID无法在镜像中重映射，announce之后链路只接受来自 24000+i 的数据报，实例按端口区分，
+        PX4Rewind在恢复后用 PX4LinkPool.check_ports 确认每个实例的心跳来自自己的端口。
+
+        :param instance_count: 实例数量
+        :param golden_num: 黄金实例的编号
+        :param flight_time: 黄金实例上传任务后飞行的时间（秒）
+        """
+        os.system(f"rm -rf {self.px4_working_dir}/")
+        os.system(f"rm -rf {self.criu_imgs_dir}")
+        os.system("killall px4")
+
+        # 飞行并保存黄金镜像
+        pid = self._start_golden_px4_sih(golden_num)
+        print(f"开启黄金仿真{golden_num}")
+        time.sleep(5)
+        self.px4Mission.start_single_mission(golden_num)
+        time.sleep(flight_time)
+        golden_img_dir = f"{self.px4_working_dir}/criu_img_dir/golden_img"
+        if not self.scheduler.run([self.dump_job(golden_num, pid, golden_img_dir)])[0].ok:
+            raise RuntimeError(f"黄金实例{golden_num}保存失败")
+        print(f"成功保存黄金实例{golden_num}")
+
+        # 为每个实例生成镜像和工作目录
+        golden_dir = f"{self.px4_working_dir}/instance_dir/instance_{golden_num}"
+        for instance_num in range(instance_count):
+            img_dir = f"{self.px4_working_dir}/criu_img_dir/px4_{instance_num}_img"
+            self._remap_criu_img(golden_img_dir, img_dir, golden_num, instance_num)
+            if instance_num != golden_num:
+                # 黄金实例以root运行，工作目录需要用sudo复制
+                instance_dir = f"{self.px4_working_dir}/instance_dir/instance_{instance_num}"
+                os.system(f"sudo rm -rf {instance_dir} && sudo cp -a {golden_dir} {instance_dir}")
+        print(f"已由黄金镜像生成{instance_count}个实例镜像")
+
+
+
+def benchmark_checkpoint(instance_count=12, batch_sizes=(1, 4), serial=True):
+    """
+    比较逐个生成检查点（make_single_px4_sih_checkpoint，固定等待）与并行流水线
+    （make_multiple_px4_sih_checkpoint，不同batch_size）生成instance_count个检查点的耗时。
+    需要px4和criu，在Cptool目录下运行。
+
+    :param instance_count: 检查点数量
+    :param batch_sizes: 流水线同时启动的实例数
+    :param serial: 是否测量逐个生成的耗时
+    :return: {名称: 耗时（秒）}
+    """
+    px4Criu = PX4Criu()
+    batch_size = px4Criu.checkpoint_config["batch_size"]
+    results = {}
+    try:
+        if serial:
+            os.system(f"rm -rf {px4Criu.px4_working_dir}/")
+            os.system(f"rm -rf {px4Criu.criu_imgs_dir}")
+            os.system("killall px4")
+            start_time = time.perf_counter()
+            for instance_num in range(instance_count):
+                px4Criu.make_single_px4_sih_checkpoint(instance_num)
+            results["serial"] = time.perf_counter() - start_time
+        for size in batch_sizes:
+            px4Criu.checkpoint_config["batch_size"] = size
+            start_time = time.perf_counter()
+            failed = px4Criu.make_multiple_px4_sih_checkpoint(instance_count)
+            results[f"pipeline(batch_size={size})"] = time.perf_counter() - start_time
+            if failed:
+                print(f"batch_size={size}: {len(failed)}个实例失败")
+    finally:
+        px4Criu.checkpoint_config["batch_size"] = batch_size
+        px4Criu.registry.kill()
+        os.system("killall px4 2>/dev/null")
+
+    for name, elapsed in results.items():
+        print(f"{name}: {instance_count}个检查点耗时 {elapsed:.2f} 秒，平均 {elapsed / instance_count:.2f} 秒/个")
+    return results
 
 
 if __name__ == "__main__":
     px4Criu = PX4Criu()
     px4Criu.make_multiple_px4_sih_checkpoint(100)
+    # 只飞一次，由黄金镜像生成全部检查点
+    # px4Criu.make_golden_px4_sih_checkpoint(100)
     px4Criu.save_criu_imgs()
 
 
@@ -160,15 +604,5 @@ if __name__ == "__main__":
 
     px4Criu.recover_criu_imgs()
 
-    # while True:
-    #     print("开始恢复")
-    #     pids = px4Criu.restore_multiple_px4_proecss(list(range(100)))
-        
-    #     time.sleep(10)
-    #     print("开始回溯")
-    #     px4Criu.dump_multiple_px4_proecss(list(range(100)),list(pids))
-    #     time.sleep(1)
-
-    #     px4Criu.recover_criu_imgs()
-
- 
+    # 恢复-评估-回溯的循环见 PX4Rewind.py
+    # 检查点生成耗时的对比见 benchmark_checkpoint()
@@ -0,0 +1,149 @@
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def dir_size(path):
+    """目录下所有文件的总字节数，硬链接的文件按一份计算"""
+    total = 0
+    seen = set()
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                stat = os.lstat(os.path.join(root, file_name))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) in seen:
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+            total += stat.st_size
+    return total
+
+
+class PX4CriuJob:
+    """一次criu dump/restore任务及其执行结果"""
+
+    def __init__(self, action, instance_num, cmd, img_dir, prepare=None):
+        """
+        :param action: criu子命令，例如 dump、restore
+        :param instance_num: PX4实例编号
+        :param cmd: 完整的criu命令（不含日志参数）
+        :param img_dir: 镜像目录，criu日志也写在这里
+        :param prepare: 每次执行（含重试）前调用的准备函数，例如清空镜像目录
+        """
+        self.action = action
+        self.instance_num = instance_num
+        self.cmd = cmd
+        self.img_dir = img_dir
+        self.prepare = prepare
+        # 执行结果
+        self.returncode = None
+        self.attempts = 0
+        self.duration = 0.0
+        self.image_size = 0
+        self.log_tail = ""
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    @property
+    def log_file(self):
+        return f"{self.img_dir}/{self.action}.log"
+
+    def __repr__(self):
+        return (f"PX4CriuJob({self.action}, instance={self.instance_num}, returncode={self.returncode}, "
+                f"attempts={self.attempts}, duration={self.duration:.2f}s, size={self.image_size / 2**20:.1f}MB)")
+
+
+class PX4CriuScheduler:
+    """
+    并发数受限的criu任务调度器。
+
+    同时执行的criu进程数不超过 max_jobs，避免上百个dump同时争抢页面写入的I/O。
+    每个任务都等待criu退出，记录返回码、耗时、镜像大小和日志，失败的任务按 retries 重试。
+    """
+
+    def __init__(self, max_jobs=8, retries=1):
+        """
+        :param max_jobs: 同时执行的criu任务数
+        :param retries: 失败后的重试次数
+        """
+        self.max_jobs = max_jobs
+        self.retries = retries
+        # 所有任务共用同一个线程池，run()和submit()合计不超过max_jobs个并发
+        self.executor = None
+
+    @classmethod
+    def from_config(cls, config):
+        """从config.yaml的criu配置中创建调度器"""
+        criu_config = config.get("criu", {})
+        return cls(criu_config.get("max_jobs", 8), criu_config.get("retries", 1))
+
+    def _read_log_tail(self, job, lines=5):
+        try:
+            return subprocess.check_output(["sudo", "tail", "-n", str(lines), job.log_file], text=True)
+        except (subprocess.CalledProcessError, OSError):
+            return ""
+
+    def _run_job(self, job):
+        for attempt in range(self.retries + 1):
+            if job.prepare is not None:
+                job.prepare()
+            start_time = time.perf_counter()
+            # 日志路径相对于镜像目录
+            result = subprocess.run(
+                job.cmd + ["-o", f"{job.action}.log"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            job.duration = time.perf_counter() - start_time
+            job.returncode = result.returncode
+            job.attempts = attempt + 1
+            if job.ok:
+                break
+            job.log_tail = self._read_log_tail(job)
+            print(f"criu {job.action} 实例{job.instance_num} 失败，返回码{job.returncode}，第{job.attempts}次")
+            print(job.log_tail)
+        job.image_size = dir_size(job.img_dir)
+        return job
+
+    def run(self, jobs):
+        """
+        执行一组任务并等待全部完成。
+
+        :param jobs: PX4CriuJob列表
+        :return: 执行完的任务列表，顺序与输入一致
+        """
+        jobs = list(jobs)
+        if not jobs:
+            return jobs
+        start_time = time.perf_counter()
+        futures = [self.submit(job) for job in jobs]
+        jobs = [future.result() for future in futures]
+        self.report(jobs, time.perf_counter() - start_time)
+        return jobs
+
+    def submit(self, job):
+        """
+        提交单个任务，不等待完成。
+
+        :param job: PX4CriuJob
+        :return: concurrent.futures.Future，结果为执行完的任务
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_jobs)
+        return self.executor.submit(self._run_job, job)
+
+    def report(self, jobs, elapsed):
+        """输出一组任务的成功数、耗时和吞吐量"""
+        done = [job for job in jobs if job.ok]
+        total_size = sum(job.image_size for job in done)
+        mean_duration = sum(job.duration for job in done) / len(done) if done else 0.0
+        throughput = total_size / 2**20 / elapsed if elapsed > 0 else 0.0
+        print(
+            f"criu {jobs[0].action}: {len(done)}/{len(jobs)} 成功，总耗时 {elapsed:.2f} 秒，"
+            f"单任务平均 {mean_duration:.2f} 秒，镜像 {total_size / 2**20:.1f} MB，{throughput:.1f} MB/s"
+        )
+        failed = [job.instance_num for job in jobs if not job.ok]
+        if failed:
+            print("以下实例失败:", failed)
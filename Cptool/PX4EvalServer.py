@@ -0,0 +1,284 @@
+import asyncio
+import json
+import math
+import time
+
+import numpy as np
+import yaml
+from pymavlink import mavutil
+
+from PX4Barrier import PX4Barrier, home_position_ready, is_armed, landed_disarmed, mission_active
+from PX4LinkPool import PX4LinkPool
+from PX4Mission import PX4Mission
+from PX4MissionLibrary import PX4MissionLibrary
+from PX4Param import PX4Param
+from PX4ResultCache import PX4ResultCache, build_fingerprint
+from PX4Score import PX4Score
+from PX4SihSim import PX4SihSim
+
+# 读取配置文件
+with open("./Cptool/config.yaml", "r") as f:
+    config = yaml.load(f.read(), Loader=yaml.FullLoader)
+
+
+class PX4EvalServer:
+    """
+    常驻的评估服务，维护一组预热好的SIH实例，在多组参数之间复用。
+
+    每次评估前把实例重置到已知状态：返航降落并上锁，回到home，恢复默认参数、重新上传任务、
+    重新解锁并启动任务，然后写入待测参数并评分。submit() 把待测参数分配给空闲的实例。
+    重置失败的实例被隔离并在后台重新启动，重新就绪后才放回空闲队列，候选改到其他实例上评估。
+    """
+
+    def __init__(self, pool_size=None):
+        """
+        :param pool_size: 常驻实例数量，默认为配置中的instance_count
+        """
+        self.px4_working_dir = config['paths']['px4_working_dir']
+        self.px4_build_dir = config['paths']['px4_build_dir']
+        self.sim_speed = config["simulation"]["speed"]
+        self.pool_size = pool_size if pool_size is not None else config["simulation"]["instance_count"]
+        self.is_daemon = config["simulation"]["daemon"]
+        self.base_port = config["simulation"]["connect_port_2"]
+        self.param_files = config["param_files"]["px4"]
+        self.min_altitude = config["barriers"]["mission"]["min_altitude"]
+        self.mission_timeout = config["barriers"]["mission"]["timeout"]
+        self.reset_timeout = config["barriers"].get("reset", {}).get("timeout", 120)
+        self.launch_timeout = config["barriers"]["launch"]["timeout"]
+
+        # 各参数的默认值，用于评估前重置
+        with open(self.param_files, 'r') as file:
+            self.default_values = [param["default"] for param in json.load(file).values()]
+
+        self.link_pool = PX4LinkPool(self.base_port)
+        self.px4SihSim = PX4SihSim(self.px4_working_dir, self.px4_build_dir, self.sim_speed, self.pool_size, self.is_daemon, launcher_config=config.get("launcher"))
+        self.px4Mission = PX4Mission(self.pool_size, self.base_port, self.link_pool, library=PX4MissionLibrary.from_config(config),
+                                     **config.get("mission", {}))
+        self.px4Param = PX4Param(self.pool_size, self.base_port, self.param_files, self.link_pool)
+        self.px4Score = PX4Score(self.pool_size, self.sim_speed, self.base_port, link_pool=self.link_pool,
+                                 mission_count=self.px4Mission.library.mission_count, **config.get("score", {}))
+        # 可用于评估的实例编号
+        self.instances = []
+        # 完成的飞行次数（不含失败），以及失败的评估次数
+        self.evaluations = 0
+        self.failures = 0
+        # 重置失败、正在重新启动或无法恢复的实例
+        self.quarantined = set()
+        # 空闲实例队列（在链路事件循环中创建），每次评估取一个空闲实例，结束后归还
+        self.free = None
+        self.links = {}
+        # 重复评估（PX4ReplicateEvaluator），设置后 submit 和 submit_nowait 对每组参数评估多次并返回均值
+        self.replicates = None
+        # 评估结果缓存，优化器重复提出的候选直接作答，未启用时为None
+        self.resultCache = None
+        if config.get("cache", {}).get("enabled", False):
+            self.resultCache = PX4ResultCache.from_config(config, self.param_files)
+        self.cache_context = None
+
+    def start(self):
+        """启动常驻实例，等待心跳和home位置有效"""
+        print(f"启动{self.pool_size}个常驻实例...")
+        self.px4SihSim.start_sih_sitl()
+        self.link_pool.mark_restarted(range(self.pool_size))
+        self.instances = PX4Barrier.from_config("launch", config).wait_links(
+            self.link_pool, list(range(self.pool_size)), home_position_ready
+        )
+        print(f"{len(self.instances)}个实例可用")
+        self.cache_context = self._cache_context()
+        self.link_pool.run(self._open_free_queue())
+
+    def _cache_context(self):
+        """
+        除参数外影响得分的条件。候选可能在任一常驻实例上评估，任务取所有常驻实例的任务。
+        """
+        plans = {}
+        for instance_num in self.instances:
+            plan = self.px4Mission.library.for_instance(instance_num)
+            plans[plan.name] = [plan.name, plan.waypoints, plan.accept_radius]
+        return {
+            "evaluator": "eval_server",
+            "missions": [plans[name] for name in sorted(plans)],
+            "sim_speed": self.sim_speed,
+            "build": build_fingerprint(self.px4_build_dir),
+            "score": config.get("score", {}),
+        }
+
+    def stop(self):
+        """回收所有常驻实例"""
+        self.px4SihSim.stop_sih_sitl()
+        self.link_pool.close()
+        self.instances = []
+        self.free = None
+        self.links = {}
+        self.quarantined = set()
+
+    async def _return_home(self, link):
+        """
+        已解锁的实例返航（RTL），等待其在home降落并自动上锁，使每次评估都从home起飞。
+
+        :return: 是否已在地面上锁
+        """
+        heartbeat = await link.recv_match(
+            type="HEARTBEAT", condition=lambda msg: msg.autopilot != mavutil.mavlink.MAV_AUTOPILOT_INVALID,
+            timeout=self.px4Mission.ack_timeout,
+        )
+        if heartbeat is None:
+            return False
+        if not is_armed(heartbeat):
+            return True
+        result = await self.px4Mission.send_command_async(link, mavutil.mavlink.MAV_CMD_NAV_RETURN_TO_LAUNCH)
+        if result != mavutil.mavlink.MAV_RESULT_ACCEPTED:
+            return False
+        try:
+            return await asyncio.wait_for(landed_disarmed(link), self.reset_timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def _reset(self, link):
+        """
+        把实例重置到已知状态：返航降落并上锁，恢复默认参数、重新上传任务、解锁并启动任务，
+        等待爬升到评分高度。
+
+        :return: 是否重置成功
+        """
+        if not await self._return_home(link):
+            return False
+        report = await self.px4Param.change_single_params_async(link, self.default_values)
+        if None in report.values():
+            return False
+        result = await self.px4Mission.send_command_async(link, mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 1)
+        if result != mavutil.mavlink.MAV_RESULT_ACCEPTED:
+            return False
+        if not await self.px4Mission.start_single_mission_async(link):
+            return False
+        try:
+            return await asyncio.wait_for(mission_active(link, self.min_altitude), self.mission_timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def _evaluate(self, link, param_values):
+        """
+        在一个常驻实例上评估一组参数。
+
+        :return: 得分，失败为nan；实例重置失败为None
+        """
+        if not await self._reset(link):
+            return None
+        report = await self.px4Param.change_single_params_async(link, param_values)
+        if None in report.values():
+            return float("nan")
+        return (await self.px4Score.count_score_async([link.instance_num]))[0]
+
+    async def _open_free_queue(self):
+        self.free = asyncio.Queue()
+        for instance_num in self.instances:
+            self.free.put_nowait(instance_num)
+        self.links = {link.instance_num: link for link in await self.link_pool.open(self.instances)}
+
+    async def evaluate_async(self, param_values):
+        """
+        等待一个空闲实例并在其上评估一组参数。
+
+        :return: 得分，失败为nan
+        """
+        while len(self.quarantined) < len(self.instances):
+            instance_num = await self.free.get()
+            score = None
+            try:
+                score = await self._evaluate(self.links[instance_num], param_values)
+            finally:
+                if score is None:
+                    # 重置失败的实例不放回空闲队列，避免反复返回nan，候选改到下一个空闲实例上评估
+                    self.quarantined.add(instance_num)
+                    asyncio.ensure_future(self._relaunch_async(instance_num))
+                else:
+                    self.free.put_nowait(instance_num)
+            if score is None:
+                continue
+            if math.isnan(score):
+                self.failures += 1
+            else:
+                self.evaluations += 1
+            return score
+        self.failures += 1
+        return float("nan")
+
+    async def _relaunch_async(self, instance_num):
+        """重新启动一个隔离的实例，等待home位置有效后放回空闲队列，失败则保持隔离"""
+        print(f"第{instance_num}个常驻实例重置失败，重新启动")
+        self.px4SihSim.registry.kill([instance_num])
+        link = self.links[instance_num]
+        link.reset()
+        self.px4SihSim.start_single_sih_sitl(instance_num)
+        try:
+            await asyncio.wait_for(home_position_ready(link), self.launch_timeout)
+        except asyncio.TimeoutError:
+            print(f"第{instance_num}个常驻实例重新启动失败，不再使用")
+            return
+        self.quarantined.discard(instance_num)
+        self.free.put_nowait(instance_num)
+
+    async def _evaluate_candidate_async(self, param_values):
+        """
+        评估一个候选：已在结果缓存中时直接作答；否则设置了 replicates 时重复评估并返回均值，
+        未设置时评估一次，成功的得分写入缓存。
+
+        :return: 得分，失败为nan
+        """
+        key = None
+        if self.resultCache is not None:
+            key = self.resultCache.key(param_values, self.cache_context)
+            score = self.resultCache.lookup(key)
+            if score is not None:
+                return score
+        if self.replicates is None:
+            score = await self.evaluate_async(param_values)
+        else:
+            score, _, _, _ = await self.replicates.evaluate_async(self.evaluate_async, param_values)
+        if key is not None:
+            self.resultCache.put(key, score, param_values)
+            self.resultCache.commit()
+        return score
+
+    async def _submit_async(self, param_group):
+        return await asyncio.gather(*(self._evaluate_candidate_async(param_values) for param_values in param_group))
+
+    def submit(self, param_group):
+        """
+        评估多组参数，参数组数量可以多于常驻实例数量。
+        设置了 replicates 时与 submit_nowait 一样重复评估每组参数。
+
+        :param param_group: 参数值列表的列表
+        :return: 与param_group顺序一致的得分列表（重复评估时为均值），失败为nan
+        """
+        if not self.instances:
+            raise RuntimeError("没有可用的常驻实例，请先调用start()")
+        return self.link_pool.run(self._submit_async(param_group))
+
+    def submit_nowait(self, param_values):
+        """
+        提交一组参数，不等待评估完成。有空闲实例时立即开始，否则排队。
+        设置了 replicates 时在多个实例上重复评估，明显差于当前最优的参数提前停止。
+
+        :param param_values: 参数值列表
+        :return: concurrent.futures.Future，结果为得分（重复评估时为均值），失败为nan
+        """
+        if not self.instances:
+            raise RuntimeError("没有可用的常驻实例，请先调用start()")
+        return asyncio.run_coroutine_threadsafe(self._evaluate_candidate_async(param_values), self.link_pool.loop)
+
+
+if __name__ == "__main__":
+    param_values = [9.8, 9.4, 0.1, 0.1, 1.0, 0.6, 0.6, 0.02, 0.01, 89.0, 4.0, 3.0, 1.7, 4.8]
+
+    px4EvalServer = PX4EvalServer()
+    px4EvalServer.start()
+    try:
+        for round_num in range(3):
+            start_time = time.perf_counter()
+            scores = px4EvalServer.submit([param_values] * px4EvalServer.pool_size)
+            print(scores)
+            print("以下编号测试失败:", np.where(np.isnan(scores))[0])
+            print(f"第{round_num}轮 耗时: {time.perf_counter() - start_time:.4f} 秒")
+    finally:
+        px4EvalServer.stop()
@@ -0,0 +1,138 @@
+import asyncio
+import concurrent.futures
+import threading
+
+from PX4MavMux import HEARTBEAT_TIMEOUT, PX4MavMux
+
+
+class PX4LinkPool:
+    """
+    长期存在的MAVLink链路管理器，按实例编号保存链路。
+
+    链路在后台线程的事件循环中一直接收消息，因此心跳就绪标志和目标系统/组件
+    始终是最新的。任务上传、参数修改和评分三个阶段共用同一组链路，
+    只有实例重启后才需要重新等待心跳。
+    """
+
+    def __init__(self, base_port, host="127.0.0.1"):
+        """
+        :param base_port: 基础端口号
+        :param host: 绑定的地址
+        """
+        self.base_port = base_port
+        self.host = host
+        # 默认只解码心跳，其余消息类型由各阶段按需追加
+        self.mux = PX4MavMux([], base_port, host, msg_types=["HEARTBEAT"])
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout=None):
+        """
+        在链路所在的事件循环中执行协程，并阻塞等待结果。
+
+        :param coro: 协程对象
+        :param timeout: 最长等待时间（秒），超时后取消协程并抛出 concurrent.futures.TimeoutError，
+                        None表示一直等待（评估一批参数等长时间任务）
+        :return: 协程的返回值
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    async def open(self, instances):
+        """
+        获取（必要时绑定）一组实例的链路，须在链路所在的事件循环中调用。
+
+        :param instances: PX4实例编号列表
+        :return: 对应的链路列表
+        """
+        return await self.mux.open_links(instances)
+
+    async def wait_heartbeat(self, instances, timeout=HEARTBEAT_TIMEOUT):
+        """
+        等待一组实例的心跳，已就绪的实例不再等待。
+
+        :param instances: PX4实例编号列表
+        :param timeout: 每个实例的超时时间（秒），None时使用 HEARTBEAT_TIMEOUT
+        :return: 对应的链路列表
+        """
+        links = await self.open(instances)
+        await asyncio.gather(*(link.wait_heartbeat(timeout) for link in links))
+        return links
+
+    def get(self, instance_num, timeout=HEARTBEAT_TIMEOUT):
+        """
+        同步获取单个实例心跳就绪的链路。
+
+        :param instance_num: PX4实例编号
+        :param timeout: 超时时间（秒），None时使用 HEARTBEAT_TIMEOUT
+        :return: 链路对象（超时时心跳可能尚未就绪，见 link.heartbeat_ready）
+        """
+        timeout = HEARTBEAT_TIMEOUT if timeout is None else timeout
+        # 多留一秒给事件循环调度，协程本身已按timeout结束
+        return self.run(self.wait_heartbeat([instance_num], timeout), timeout + 1.0)[0]
+
+    def is_ready(self, instance_num):
+        link = self.mux.links.get(instance_num)
+        return link is not None and link.heartbeat_ready
+
+    def mark_restarted(self, instances):
+        """
+        实例重启后调用，清除心跳与目标信息，端口保持绑定。
+
+        :param instances: PX4实例编号列表
+        """
+        def reset():
+            for instance_num in instances:
+                link = self.mux.links.get(instance_num)
+                if link is not None:
+                    link.reset()
+
+        self.loop.call_soon_threadsafe(reset)
+
+    def announce(self, instances, px4_base_port):
+        """
+        向一组实例的PX4本地端口发送地面站心跳，让PX4改为向本链路发送。
+        用于从同一镜像恢复、仍向原端口发送的实例。之后每条链路只接受来自 px4_base_port + 实例编号 的数据报，
+        实例按端口而不是MAVLink系统ID区分（黄金镜像恢复的实例系统ID相同）。
+
+        :param instances: PX4实例编号列表
+        :param px4_base_port: PX4本地MAVLink端口的基础端口号
+        """
+        async def announce():
+            for link in await self.open(instances):
+                # 之前收到的心跳可能来自其他实例，重新等待本实例的心跳
+                link.reset()
+                link.connect((self.host, px4_base_port + link.instance_num))
+
+        self.run(announce())
+
+    def check_ports(self, instances, px4_base_port):
+        """
+        检查一组实例的心跳是否来自各自的PX4本地端口。
+
+        :param instances: PX4实例编号列表
+        :param px4_base_port: PX4本地MAVLink端口的基础端口号
+        :return: 心跳来源端口不符的实例编号列表
+        """
+        mismatched = []
+        for instance_num in instances:
+            link = self.mux.links.get(instance_num)
+            if link is None or not link.heartbeat_ready:
+                continue
+            if link.remote_addr is None or link.remote_addr[1] != px4_base_port + instance_num:
+                mismatched.append(instance_num)
+        return mismatched
+
+    def close(self):
+        """关闭所有链路并停止事件循环"""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.mux.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
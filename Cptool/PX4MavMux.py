@@ -0,0 +1,339 @@
+import asyncio
+
+from pymavlink.dialects.v20 import common as mavlink
+
+
+# MAVLink帧头常量
+_MAGIC_V1 = 0xFE
+_MAGIC_V2 = 0xFD
+_SIGNATURE_LEN = 13
+# 等待心跳的默认超时时间（秒），实例没有启动时不会一直等待
+HEARTBEAT_TIMEOUT = 10.0
+
+
+def msg_ids_of(msg_types):
+    """
+    将消息类型名转换为消息ID集合。
+
+    :param msg_types: 消息类型名列表，例如 ["ATTITUDE", "HEARTBEAT"]
+    :return: 消息ID集合，msg_types为None时返回None（表示接收全部消息）
+    """
+    if msg_types is None:
+        return None
+    msg_types = set(msg_types)
+    return {msg_cls.id for msg_cls in mavlink.mavlink_map.values() if msg_cls.msgname in msg_types}
+
+
+class PX4MavLink(asyncio.DatagramProtocol):
+    """
+    单个PX4实例的MAVLink UDP链路。
+
+    在事件循环中接收数据报，按帧头直接切分MAVLink帧，只解码关心的消息ID，
+    解码后的消息交给复用器分发。self.mav 可像 pymavlink 连接一样用于发送消息。
+    """
+
+    def __init__(self, instance_num, dispatch, msg_ids=None):
+        """
+        :param instance_num: PX4实例的编号
+        :param dispatch: 消息分发函数 dispatch(link, msg)
+        :param msg_ids: 需要解码的消息ID集合，None表示全部解码
+        """
+        self.instance_num = instance_num
+        self.dispatch = dispatch
+        self.msg_ids = msg_ids
+        self.transport = None
+        # PX4的发送地址，收到第一帧后才知道往哪里回发
+        self.remote_addr = None
+        # 只接受来自该源端口的数据报，None表示不限。由黄金镜像恢复的实例共用黄金实例的系统ID，
+        # 并可能都向黄金实例的端口发送，此时只能按PX4的本地端口区分实例
+        self.expected_port = None
+        self.mav = mavlink.MAVLink(self, srcSystem=255, srcComponent=0)
+        # 由PX4心跳得到的目标系统/组件，以及心跳是否已就绪
+        self.target_system = 0
+        self.target_component = 0
+        self.heartbeat_ready = False
+        # 最近一次消息中的 time_boot_ms，用于发现实例重启
+        self.last_boot_ms = 0
+        # 等待特定消息的协程：(消息类型集合, 条件, future)
+        self.waiters = []
+        # 订阅消息流的队列：(消息类型集合, asyncio.Queue)
+        self.queues = []
+        # 收发统计
+        self.frames_received = 0
+        self.frames_decoded = 0
+        self.errors = 0
+        # 因源端口不符丢弃的数据报数
+        self.foreign = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+    def datagram_received(self, data, addr):
+        if self.expected_port is not None and addr[1] != self.expected_port:
+            self.foreign += 1
+            return
+        self.remote_addr = addr
+        for msg_id, frame in self._split_frames(data):
+            self.frames_received += 1
+            if self.msg_ids is not None and msg_id not in self.msg_ids:
+                continue
+            try:
+                msg = self.mav.decode(bytearray(frame))
+            except mavlink.MAVError:
+                self.errors += 1
+                continue
+            self.frames_decoded += 1
+            self._update_state(msg)
+            if self.waiters:
+                self._notify_waiters(msg)
+            for types, queue in self.queues:
+                if msg.get_type() in types:
+                    queue.put_nowait(msg)
+            self.dispatch(self, msg)
+
+    def _update_state(self, msg):
+        """根据心跳记录目标系统/组件；time_boot_ms 明显回退说明实例已重启"""
+        boot_ms = getattr(msg, "time_boot_ms", None)
+        if boot_ms is not None:
+            if boot_ms + 1000 < self.last_boot_ms:
+                self.reset()
+            self.last_boot_ms = boot_ms
+        if msg.get_type() == "HEARTBEAT" and msg.autopilot != mavlink.MAV_AUTOPILOT_INVALID:
+            self.target_system = msg.get_srcSystem()
+            self.target_component = msg.get_srcComponent()
+            self.heartbeat_ready = True
+
+    def _notify_waiters(self, msg):
+        msg_type = msg.get_type()
+        for waiter in list(self.waiters):
+            types, condition, future = waiter
+            if future.done() or (types is not None and msg_type not in types):
+                continue
+            if condition is not None and not condition(msg):
+                continue
+            future.set_result(msg)
+            self.waiters.remove(waiter)
+
+    def reset(self):
+        """实例重启后清除心跳与目标信息，等待新的心跳"""
+        self.target_system = 0
+        self.target_component = 0
+        self.heartbeat_ready = False
+        self.last_boot_ms = 0
+
+    async def recv_match(self, type=None, condition=None, timeout=None):
+        """
+        等待下一条符合条件的消息，与 pymavlink 的 recv_match 用法相同。
+
+        :param type: 消息类型名或类型名列表，None表示任意类型
+        :param condition: 额外的过滤函数 condition(msg)
+        :param timeout: 超时时间（秒），None表示一直等待
+        :return: 收到的消息，超时返回None
+        """
+        if isinstance(type, str):
+            type = [type]
+        types = set(type) if type is not None else None
+        # 确保等待的消息类型会被解码
+        if self.msg_ids is not None:
+            self.msg_ids.update(msg_ids_of(types) if types is not None else mavlink.mavlink_map.keys())
+        future = asyncio.get_running_loop().create_future()
+        waiter = (types, condition, future)
+        self.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def subscribe(self, type):
+        """
+        订阅某些类型的消息。与 recv_match 不同，两次读取之间到达的消息不会丢失。
+
+        :param type: 消息类型名或类型名列表
+        :return: asyncio.Queue，收到的消息按到达顺序放入
+        """
+        if isinstance(type, str):
+            type = [type]
+        types = set(type)
+        if self.msg_ids is not None:
+            self.msg_ids.update(msg_ids_of(types))
+        queue = asyncio.Queue()
+        self.queues.append((types, queue))
+        return queue
+
+    def unsubscribe(self, queue):
+        self.queues = [(types, q) for types, q in self.queues if q is not queue]
+
+    async def wait_heartbeat(self, timeout=HEARTBEAT_TIMEOUT):
+        """
+        等待PX4心跳，已就绪时立即返回。
+
+        :param timeout: 超时时间（秒），None时使用 HEARTBEAT_TIMEOUT
+        :return: 心跳是否就绪
+        """
+        if timeout is None:
+            timeout = HEARTBEAT_TIMEOUT
+        if not self.heartbeat_ready:
+            await self.recv_match(
+                type="HEARTBEAT", condition=lambda msg: msg.autopilot != mavlink.MAV_AUTOPILOT_INVALID, timeout=timeout
+            )
+        return self.heartbeat_ready
+
+    def _split_frames(self, data):
+        """
+        按帧头把一个UDP数据报切分为若干MAVLink帧。
+
+        PX4会把多帧打包进同一个数据报，但不会把一帧拆到两个数据报中，
+        因此无需跨数据报缓存。遇到无法识别的字节时丢弃数据报剩余部分。
+
+        :param data: UDP数据报
+        :return: (消息ID, 帧字节) 的生成器
+        """
+        pos = 0
+        size = len(data)
+        while pos < size:
+            magic = data[pos]
+            if magic == _MAGIC_V2:
+                if pos + 10 > size:
+                    break
+                end = pos + 12 + data[pos + 1]
+                if data[pos + 2] & mavlink.MAVLINK_IFLAG_SIGNED:
+                    end += _SIGNATURE_LEN
+                msg_id = data[pos + 7] | (data[pos + 8] << 8) | (data[pos + 9] << 16)
+            elif magic == _MAGIC_V1:
+                if pos + 6 > size:
+                    break
+                end = pos + 8 + data[pos + 1]
+                msg_id = data[pos + 5]
+            else:
+                self.errors += 1
+                break
+            if end > size:
+                self.errors += 1
+                break
+            yield msg_id, data[pos:end]
+            pos = end
+
+    def write(self, buf):
+        """供 self.mav 发送消息时调用"""
+        if self.transport is not None and self.remote_addr is not None:
+            self.transport.sendto(bytes(buf), self.remote_addr)
+
+    def connect(self, addr):
+        """
+        主动指定PX4的地址并发送一次地面站心跳。
+
+        PX4收到地面站的数据后会改为向数据来源地址发送，从同一镜像恢复的多个实例
+        可以借此各自改为向本实例的端口发送。
+
+        :param addr: PX4的本地地址 (host, port)，之后只接受来自该端口的数据报
+        """
+        self.remote_addr = addr
+        self.expected_port = addr[1]
+        self.mav.heartbeat_send(mavlink.MAV_TYPE_GCS, mavlink.MAV_AUTOPILOT_INVALID, 0, 0, 0)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class PX4MavMux:
+    """
+    单事件循环的MAVLink复用器。
+
+    在一个事件循环里绑定所有 base_port + i 的UDP端口，
+    收到的消息按实例分发给注册的处理函数 handler(link, msg)。处理函数按实例编号登记，
+    每条消息只交给该实例的处理函数和不限实例的处理函数，不随同时评分的实例数增加。
+    """
+
+    def __init__(self, instances, base_port, host="127.0.0.1", msg_types=None):
+        """
+        :param instances: PX4实例编号列表
+        :param base_port: 基础端口号
+        :param host: 绑定的地址
+        :param msg_types: 需要解码的消息类型名列表，None表示全部解码
+        """
+        self.instances = list(instances)
+        self.base_port = base_port
+        self.host = host
+        # 所有链路共用同一个消息ID集合，watch() 可在运行中追加
+        self.msg_ids = msg_ids_of(msg_types)
+        self.links = {}
+        # 实例编号（None表示所有实例） → 处理函数列表
+        self.handlers = {}
+
+    async def open(self):
+        """为每个实例绑定UDP端口"""
+        try:
+            await self.open_links(self.instances)
+        except OSError:
+            # 端口被占用时释放已绑定的端口
+            self.close()
+            raise
+        return self
+
+    async def open_links(self, instances):
+        """
+        为尚未绑定的实例绑定UDP端口。
+
+        :param instances: PX4实例编号列表
+        :return: 对应的链路列表
+        """
+        loop = asyncio.get_running_loop()
+        for instance_num in instances:
+            if instance_num in self.links:
+                continue
+            _, link = await loop.create_datagram_endpoint(
+                lambda instance_num=instance_num: PX4MavLink(instance_num, self._dispatch, self.msg_ids),
+                local_addr=(self.host, self.base_port + instance_num),
+            )
+            self.links[instance_num] = link
+            if instance_num not in self.instances:
+                self.instances.append(instance_num)
+        return [self.links[instance_num] for instance_num in instances]
+
+    def watch(self, msg_types):
+        """
+        追加需要解码的消息类型。
+
+        :param msg_types: 消息类型名列表
+        """
+        if self.msg_ids is not None:
+            self.msg_ids.update(msg_ids_of(msg_types))
+
+    def close(self):
+        for link in self.links.values():
+            link.close()
+        self.links = {}
+
+    def add_handler(self, handler, instances=None):
+        """
+        :param handler: 处理函数 handler(link, msg)
+        :param instances: 只接收这些实例的消息，None表示所有实例
+        """
+        for instance_num in (instances if instances is not None else [None]):
+            self.handlers.setdefault(instance_num, []).append(handler)
+
+    def remove_handler(self, handler, instances=None):
+        for instance_num in (instances if instances is not None else [None]):
+            handlers = self.handlers.get(instance_num)
+            if handlers is not None and handler in handlers:
+                handlers.remove(handler)
+                if not handlers:
+                    del self.handlers[instance_num]
+
+    def _dispatch(self, link, msg):
+        for key in (None, link.instance_num):
+            for handler in self.handlers.get(key, ()):
+                handler(link, msg)
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,121 +1,193 @@
 from pymavlink import mavutil
 import time
-import math
-import multiprocessing
 import argparse
+import asyncio
 # 读取配置文件
 import yaml
 
+from PX4MavMux import PX4MavMux
+from PX4MissionLibrary import PX4MissionLibrary, PX4MissionPlan
 
 
 class PX4Mission:
-    def __init__(self,instance_count,base_port):
+    def __init__(self,instance_count,base_port,link_pool=None,ack_timeout=10.0,item_timeout=0.5,retries=5,library=None):
         self.instance_count = instance_count
         self.base_port = base_port
+        # 共享的PX4LinkPool，为None时每个实例单独建立连接
+        self.link_pool = link_pool
+        # 共享链路下等待心跳和MISSION_ACK的超时时间（秒）
+        self.ack_timeout = ack_timeout
+        # 等待任务请求、MISSION_ACK和COMMAND_ACK的超时时间（秒）与连续超时的重试次数
+        self.item_timeout = item_timeout
+        self.retries = retries
+        # 每个实例最近一次任务上传的统计 {实例编号: {upload, start, resends, error}}
+        self.upload_stats = {}
+        # 任务库，决定每个实例飞哪个任务
+        self.library = library if library is not None else PX4MissionLibrary.from_config({})
         self.processes = []
         pass
 
-    def _calculate_bearing(self, lat1, lon1, lat2, lon2):
-        """计算两个点之间的方向角（度）"""
-        # 转换为弧度
-        lat1_rad = math.radians(lat1)
-        lon1_rad = math.radians(lon1)
-        lat2_rad = math.radians(lat2)
-        lon2_rad = math.radians(lon2)
-
-        # 计算方向角
-        d_lon = lon2_rad - lon1_rad
-        y = math.sin(d_lon) * math.cos(lat2_rad)
-        x = math.cos(lat1_rad) * math.sin(lat2_rad) - \
-            math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(d_lon)
-        bearing_rad = math.atan2(y, x)
-        bearing_deg = math.degrees(bearing_rad)
-        
-        # 转换为0-360度
-        bearing_deg = (bearing_deg + 360) % 360
-        return bearing_deg
-
-    def start_single_mission(self,instance_num):
-        master = mavutil.mavlink_connection(f"udp:127.0.0.1:{self.base_port+instance_num}")
-        master.wait_heartbeat()
-        # 定义航点
-        waypoints = [
-            (45.4671172, -73.7578372, 6.096),  # 纬度, 经度, 高度（米）
-            (45.48382938, -73.73546348, 6.096),
-        ]
-        # 任务上传
-        master.mav.mission_count_send(
-            master.target_system,
-            master.target_component,
-            len(waypoints)
-        )
-        # 逐个发送航点并计算朝向
-        for i, (lat, lon, alt) in enumerate(waypoints):
- 
-            # 计算朝向（如果不是最后一个点，朝向下一个点；如果是最后一个点，保持最后的方向）
-            if i < len(waypoints) - 1:
-                next_lat, next_lon, _ = waypoints[i + 1]
-                yaw = self._calculate_bearing(lat, lon, next_lat, next_lon)
-            else:
-                # 对于最后一个航点，使用前一段的方向
-                if i > 0:
-                    prev_lat, prev_lon, _ = waypoints[i - 1]
-                    yaw = self._calculate_bearing(prev_lat, prev_lon, lat, lon)
-                else:
-                    yaw = 0.0  # 单个航点时默认朝北
-
-            master.mav.mission_item_send(
-                master.target_system,
-                master.target_component,
-                i,  # sequence
-                mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT,
-                mavutil.mavlink.MAV_CMD_NAV_WAYPOINT,
-                0,  # current (0=not current)
-                1,  # autocontinue
-                0.0,  # param1 (hold time)
-                5.0,  # param2 (accept radius)
-                0.0,  # param3 (pass radius)
-                yaw,  # param4 (yaw angle in degrees)
-                lat,  # latitude
-                lon,  # longitude
-                alt   # altitude
+    def _mission_items(self, instance_num=None):
+        """
+        任务航点及每个航点的朝向。
+
+        :param instance_num: PX4实例编号，None表示默认任务
+        :return: [(纬度, 经度, 高度, 朝向), ...]
+        """
+        return self.library.for_instance(instance_num).items
+
+    def mission_count(self, instance_num=None):
+        """实例任务的航点数量"""
+        return self.library.mission_count(instance_num)
+
+    async def upload_mission_async(self, link, plan):
+        """
+        按MAVLink任务协议上传航点：发送MISSION_COUNT，按PX4的MISSION_REQUEST(_INT)逐个发送
+        MISSION_ITEM_INT，直到收到MISSION_ACK。等待超时则重发上一条消息，连续超时retries次判定失败。
+        发送的是任务中缓存的已打包帧。
+
+        :param link: PX4MavLink链路
+        :param plan: PX4MissionPlan
+        :return: (是否被接受, 重发次数)
+        """
+        count_frame, item_frames = plan.packed(link.mav, link.target_system, link.target_component)
+        queue = link.subscribe(["MISSION_REQUEST_INT", "MISSION_REQUEST", "MISSION_ACK"])
+        resend = lambda: link.write(count_frame)
+        resends = 0
+        timeouts = 0
+        try:
+            resend()
+            while True:
+                try:
+                    msg = await asyncio.wait_for(queue.get(), self.item_timeout)
+                except asyncio.TimeoutError:
+                    timeouts += 1
+                    if timeouts > self.retries:
+                        return False, resends
+                    # 请求或航点丢失，重发上一条消息
+                    resend()
+                    resends += 1
+                    continue
+                timeouts = 0
+                if msg.get_type() == "MISSION_ACK":
+                    return msg.type == mavutil.mavlink.MAV_MISSION_ACCEPTED, resends
+                if 0 <= msg.seq < len(item_frames):
+                    resend = lambda seq=msg.seq: link.write(item_frames[seq])
+                    resend()
+        finally:
+            link.unsubscribe(queue)
+
+    async def send_command_async(self, link, command, *params):
+        """
+        发送COMMAND_LONG并等待对应的COMMAND_ACK，超时重发（confirmation递增）。
+
+        :param link: PX4MavLink链路
+        :param command: MAV_CMD命令
+        :param params: 最多7个命令参数
+        :return: COMMAND_ACK的result，未收到为None
+        """
+        params = list(params) + [0] * (7 - len(params))
+        for confirmation in range(self.retries + 1):
+            link.mav.command_long_send(link.target_system, link.target_component, command, confirmation, *params)
+            msg = await link.recv_match(
+                type="COMMAND_ACK", condition=lambda msg: msg.command == command, timeout=self.item_timeout
             )
-            # print(yaw,lat,lon,alt)
+            if msg is not None and msg.result != mavutil.mavlink.MAV_RESULT_IN_PROGRESS:
+                return msg.result
+        return None
 
-        # 等待MISSION_ACK
-        msg = master.recv_match(type='MISSION_ACK', blocking=True)
-        
-        # 等待几秒确保上传完成
-        time.sleep(1)
-        
-        # 开始任务
+    async def _send_mission_start_async(self, link):
+        """切换到MISSION模式并启动任务，两条命令都须被接受"""
         # 切换到MISSION模式
-        master.set_mode('MISSION')
-        
+        mode, custom_mode, custom_sub_mode = mavutil.px4_map['MISSION']
+        result = await self.send_command_async(link, mavutil.mavlink.MAV_CMD_DO_SET_MODE, mode, custom_mode, custom_sub_mode)
+        if result != mavutil.mavlink.MAV_RESULT_ACCEPTED:
+            return False
         # 启动任务
-        master.mav.command_long_send(
-            master.target_system,
-            master.target_component,
-            mavutil.mavlink.MAV_CMD_MISSION_START,
-            0,  # confirmation
-            0,  # param1 (first item)
-            0,  # param2 (last item)
-            0, 0, 0, 0, 0  # unused parameters
-        )
-
-        # 等待任务开始的确认
-        # msg = master.recv_match(type='COMMAND_ACK', blocking=True)
-        
-        master.close()
-        print(f"第{instance_num}架px4开始任务")
+        result = await self.send_command_async(link, mavutil.mavlink.MAV_CMD_MISSION_START, 0, 0)
+        return result == mavutil.mavlink.MAV_RESULT_ACCEPTED
 
-    def start_multiple_mission(self):
-        instances = list(range(self.instance_count))
+    def start_single_mission(self,instance_num):
+        """为单个实例上传并启动任务，不使用共享链路时临时绑定端口"""
+        return self.start_multiple_mission([instance_num])[0]
+
+    async def start_single_mission_async(self, link, plan=None):
+        """
+        通过共享链路为单个实例上传并启动任务，记录上传和启动耗时。
+
+        :param link: PX4MavLink链路
+        :param plan: PX4MissionPlan、任务名或航点列表，默认为任务库中该实例的任务
+        :return: 任务是否被接受并启动
+        """
+        if plan is None:
+            plan = self.library.for_instance(link.instance_num)
+        elif isinstance(plan, str):
+            plan = self.library.get(plan)
+        elif not isinstance(plan, PX4MissionPlan):
+            plan = PX4MissionPlan(None, [item[:3] for item in plan])
+        stats = {"upload": None, "start": None, "resends": 0, "error": None}
+        self.upload_stats[link.instance_num] = stats
+        if not await link.wait_heartbeat(self.ack_timeout):
+            stats["error"] = "heartbeat"
+            return False
+
+        start_time = time.perf_counter()
+        accepted, stats["resends"] = await self.upload_mission_async(link, plan)
+        stats["upload"] = time.perf_counter() - start_time
+        if not accepted:
+            stats["error"] = "upload"
+            print(f"第{link.instance_num}架px4任务上传失败")
+            return False
 
-        # 并行执行计算得分函数
-        with multiprocessing.Pool() as pool:
-            pool.map(self.start_single_mission, instances)
-            # pool.join()   # 等待所有任务完成        
+        # 开始任务
+        start_time = time.perf_counter()
+        if not await self._send_mission_start_async(link):
+            stats["error"] = "start"
+            print(f"第{link.instance_num}架px4任务启动失败")
+            return False
+        stats["start"] = time.perf_counter() - start_time
+        print(f"第{link.instance_num}架px4开始任务")
+        return True
+
+    async def _start_multiple_mission_async(self, instances):
+        links = await self.link_pool.open(instances)
+        return await asyncio.gather(*(self.start_single_mission_async(link) for link in links))
+
+    async def _start_multiple_mission_mux_async(self, instances):
+        # 没有共享链路时，在一个事件循环中为所有实例临时绑定端口
+        msg_types = ["HEARTBEAT", "MISSION_REQUEST_INT", "MISSION_REQUEST", "MISSION_ACK", "COMMAND_ACK"]
+        async with PX4MavMux(instances, self.base_port, msg_types=msg_types) as mux:
+            return await asyncio.gather(*(self.start_single_mission_async(mux.links[instance]) for instance in instances))
+
+    def report_upload_stats(self, instances):
+        """输出一组实例的任务上传耗时和失败情况"""
+        stats = [self.upload_stats[instance] for instance in instances if instance in self.upload_stats]
+        uploads = [stat["upload"] for stat in stats if stat["error"] is None]
+        failed = {instance: self.upload_stats[instance]["error"] for instance in instances
+                  if self.upload_stats.get(instance, {}).get("error") is not None}
+        if uploads:
+            print(f"任务上传: {len(uploads)}/{len(instances)} 成功，平均 {sum(uploads) / len(uploads):.3f} 秒，"
+                  f"最长 {max(uploads):.3f} 秒，重发 {sum(stat['resends'] for stat in stats)} 次")
+        if failed:
+            print("以下实例任务失败:", failed)
+
+    def start_multiple_mission(self, instances=None):
+        """
+        在一个事件循环中为所有实例上传并启动任务。
+
+        :param instances: PX4实例编号列表，默认全部
+        :return: 与instances顺序一致的是否成功列表
+        """
+        if instances is None:
+            instances = list(range(self.instance_count))
+
+        # 有共享链路时在链路的事件循环中为所有实例上传任务
+        if self.link_pool is not None:
+            results = self.link_pool.run(self._start_multiple_mission_async(instances))
+        else:
+            results = asyncio.run(self._start_multiple_mission_mux_async(instances))
+        self.report_upload_stats(instances)
+        return results
 
 def main():
     with open("./Cptool/config.yaml", "r") as f:
@@ -130,7 +202,8 @@ def main():
     args = parser.parse_args()
         
     # 创建PX4Mission实例
-    px4 = PX4Mission(args.instance_count,config["simulation"]["connect_port_1"])
+    px4 = PX4Mission(args.instance_count,config["simulation"]["connect_port_1"],
+                     library=PX4MissionLibrary.from_config(config),**config.get("mission", {}))
     # 开始执行任务
     
     px4.start_multiple_mission()
@@ -0,0 +1,283 @@
+import json
+import math
+
+from pymavlink.dialects.v20 import common as mavlink
+
+# 地球半径（米），用于把米制偏移换算为经纬度
+EARTH_RADIUS = 6378137.0
+
+
+def calculate_bearing(lat1, lon1, lat2, lon2):
+    """计算两个点之间的方向角（度，0-360）"""
+    # 转换为弧度
+    lat1_rad = math.radians(lat1)
+    lon1_rad = math.radians(lon1)
+    lat2_rad = math.radians(lat2)
+    lon2_rad = math.radians(lon2)
+
+    # 计算方向角
+    d_lon = lon2_rad - lon1_rad
+    y = math.sin(d_lon) * math.cos(lat2_rad)
+    x = math.cos(lat1_rad) * math.sin(lat2_rad) - \
+        math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(d_lon)
+    bearing_deg = math.degrees(math.atan2(y, x))
+
+    # 转换为0-360度
+    return (bearing_deg + 360) % 360
+
+
+def offset_position(lat, lon, north, east):
+    """
+    把相对于(lat, lon)的北向、东向偏移（米）换算为经纬度。
+
+    :return: (纬度, 经度)
+    """
+    d_lat = north / EARTH_RADIUS
+    d_lon = east / (EARTH_RADIUS * math.cos(math.radians(lat)))
+    return lat + math.degrees(d_lat), lon + math.degrees(d_lon)
+
+
+def _rotate(north, east, heading):
+    """把局部坐标按航向（度，顺时针）旋转"""
+    heading_rad = math.radians(heading)
+    return (north * math.cos(heading_rad) - east * math.sin(heading_rad),
+            north * math.sin(heading_rad) + east * math.cos(heading_rad))
+
+
+def line_waypoints(lat, lon, alt, length, heading=0.0, count=2):
+    """
+    直线任务：从起点沿航向等间距的 count 个航点。
+
+    :param length: 直线长度（米）
+    :param heading: 航向（度，正北为0）
+    :return: [(纬度, 经度, 高度), ...]
+    """
+    waypoints = []
+    for i in range(count):
+        north, east = _rotate(length * i / max(count - 1, 1), 0.0, heading)
+        waypoints.append(offset_position(lat, lon, north, east) + (alt,))
+    return waypoints
+
+
+def box_waypoints(lat, lon, alt, width, height, heading=0.0):
+    """
+    矩形任务：从起点出发绕矩形一周回到起点。
+
+    :param width: 沿航向方向的边长（米）
+    :param height: 垂直于航向方向（向右）的边长（米）
+    :return: [(纬度, 经度, 高度), ...]
+    """
+    corners = [(0.0, 0.0), (width, 0.0), (width, height), (0.0, height), (0.0, 0.0)]
+    return [offset_position(lat, lon, *_rotate(north, east, heading)) + (alt,) for north, east in corners]
+
+
+def figure_eight_waypoints(lat, lon, alt, radius, points=16, heading=0.0):
+    """
+    8字形任务（Gerono双纽线），两个环在起点处交叉。
+
+    :param radius: 每个环的半长（米）
+    :param points: 航点数量
+    :return: [(纬度, 经度, 高度), ...]
+    """
+    waypoints = []
+    for i in range(points + 1):
+        t = 2 * math.pi * i / points
+        north, east = _rotate(radius * math.sin(t), radius * math.sin(t) * math.cos(t), heading)
+        waypoints.append(offset_position(lat, lon, north, east) + (alt,))
+    return waypoints
+
+
+def load_plan_waypoints(path):
+    """
+    读取QGroundControl的.plan文件中的航点（只取 MAV_CMD_NAV_WAYPOINT 类型的简单航点）。
+
+    :param path: .plan文件路径
+    :return: [(纬度, 经度, 高度), ...]
+    """
+    with open(path, "r") as f:
+        plan = json.load(f)
+    waypoints = []
+    for item in plan["mission"]["items"]:
+        if item.get("type") != "SimpleItem" or item.get("command") != mavlink.MAV_CMD_NAV_WAYPOINT:
+            continue
+        params = item["params"]
+        waypoints.append((params[4], params[5], params[6]))
+    return waypoints
+
+
+class PX4MissionPlan:
+    """
+    一个任务的航点，创建时计算好每个航点的朝向。
+
+    按目标系统/组件缓存打包好的 MISSION_COUNT 和 MISSION_ITEM_INT 帧，
+    同一任务重复上传时直接发送缓存的字节，不再重新编码。缓存帧中的MAVLink包序号固定，
+    PX4只用它统计丢包，不影响任务协议。
+    """
+
+    def __init__(self, name, waypoints, accept_radius=5.0):
+        """
+        :param name: 任务名
+        :param waypoints: [(纬度, 经度, 高度), ...]
+        :param accept_radius: 航点的接受半径（米）
+        """
+        self.name = name
+        self.waypoints = [tuple(waypoint) for waypoint in waypoints]
+        self.accept_radius = accept_radius
+        if not self.waypoints:
+            raise ValueError(f"任务{name}没有航点")
+        self.items = self._with_yaw(self.waypoints)
+        # (srcSystem, srcComponent, target_system, target_component) → (MISSION_COUNT帧, [MISSION_ITEM_INT帧])
+        self.packed_cache = {}
+
+    def _with_yaw(self, waypoints):
+        items = []
+        for i, (lat, lon, alt) in enumerate(waypoints):
+            # 计算朝向（如果不是最后一个点，朝向下一个点；如果是最后一个点，保持最后的方向）
+            if i < len(waypoints) - 1:
+                next_lat, next_lon, _ = waypoints[i + 1]
+                yaw = calculate_bearing(lat, lon, next_lat, next_lon)
+            elif i > 0:
+                # 对于最后一个航点，使用前一段的方向
+                yaw = items[-1][3]
+            else:
+                yaw = 0.0  # 单个航点时默认朝北
+            items.append((lat, lon, alt, yaw))
+        return items
+
+    def __len__(self):
+        return len(self.items)
+
+    def item_message(self, seq, target_system, target_component):
+        """第seq个航点的 MISSION_ITEM_INT 消息"""
+        lat, lon, alt, yaw = self.items[seq]
+        return mavlink.MAVLink_mission_item_int_message(
+            target_system,
+            target_component,
+            seq,  # sequence
+            mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT_INT,
+            mavlink.MAV_CMD_NAV_WAYPOINT,
+            0,  # current (0=not current)
+            1,  # autocontinue
+            0.0,  # param1 (hold time)
+            self.accept_radius,  # param2 (accept radius)
+            0.0,  # param3 (pass radius)
+            yaw,  # param4 (yaw angle in degrees)
+            int(round(lat * 1e7)),  # latitude (degE7)
+            int(round(lon * 1e7)),  # longitude (degE7)
+            alt   # altitude
+        )
+
+    def packed(self, mav, target_system, target_component):
+        """
+        :param mav: 发送方的 pymavlink MAVLink 对象
+        :return: (MISSION_COUNT帧, [各航点的MISSION_ITEM_INT帧])
+        """
+        key = (mav.srcSystem, mav.srcComponent, target_system, target_component)
+        if key not in self.packed_cache:
+            count_msg = mavlink.MAVLink_mission_count_message(target_system, target_component, len(self.items))
+            self.packed_cache[key] = (
+                bytes(count_msg.pack(mav)),
+                [bytes(self.item_message(seq, target_system, target_component).pack(mav)) for seq in range(len(self.items))],
+            )
+        return self.packed_cache[key]
+
+
+class PX4MissionLibrary:
+    """
+    任务库：按名称保存任务，并为每个PX4实例指定要飞的任务。
+
+    任务在加载时生成一次，同一次评估中不同实例可以飞不同的任务。
+    实例优先使用单独指定的任务，其次按编号轮流使用 rotation 中的任务，否则使用默认任务。
+    """
+
+    # 原先写死在PX4Mission中的航点
+    DEFAULT_WAYPOINTS = [
+        (45.4671172, -73.7578372, 6.096),  # 纬度, 经度, 高度（米）
+        (45.48382938, -73.73546348, 6.096),
+    ]
+
+    def __init__(self, default="default", rotation=None):
+        """
+        :param default: 默认任务名
+        :param rotation: 按实例编号轮流分配的任务名列表
+        """
+        self.plans = {}
+        self.default = default
+        self.rotation = list(rotation or [])
+        # 实例编号 → 单独指定的任务名
+        self.assignment = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        从config.yaml的missions配置中创建任务库，未配置时只有默认航点。
+
+        每个任务的 type 为 waypoints、plan、line、box 或 figure_eight，其余键为对应生成函数的参数。
+        """
+        missions_config = config.get("missions") or {}
+        library = cls(missions_config.get("default", "default"), missions_config.get("rotation"))
+        plans = missions_config.get("plans") or {"default": {"type": "waypoints", "waypoints": cls.DEFAULT_WAYPOINTS}}
+        for name, spec in plans.items():
+            library.add_spec(name, spec)
+        for name in [library.default] + library.rotation:
+            library.get(name)
+        return library
+
+    def add(self, plan):
+        self.plans[plan.name] = plan
+        return plan
+
+    def add_spec(self, name, spec):
+        """
+        按配置生成任务并加入任务库。
+
+        :param name: 任务名
+        :param spec: {type: ..., accept_radius: ..., 生成函数的参数}
+        """
+        spec = dict(spec)
+        mission_type = spec.pop("type", "waypoints")
+        accept_radius = spec.pop("accept_radius", 5.0)
+        if mission_type == "waypoints":
+            waypoints = spec["waypoints"]
+        elif mission_type == "plan":
+            waypoints = load_plan_waypoints(spec["path"])
+        elif mission_type == "line":
+            waypoints = line_waypoints(**spec)
+        elif mission_type == "box":
+            waypoints = box_waypoints(**spec)
+        elif mission_type == "figure_eight":
+            waypoints = figure_eight_waypoints(**spec)
+        else:
+            raise ValueError(f"未知的任务类型: {mission_type}")
+        return self.add(PX4MissionPlan(name, waypoints, accept_radius))
+
+    def get(self, name):
+        if name not in self.plans:
+            raise KeyError(f"任务库中没有任务: {name}")
+        return self.plans[name]
+
+    def assign(self, instances, name):
+        """
+        为一组实例单独指定任务。
+
+        :param instances: PX4实例编号列表
+        :param name: 任务名
+        """
+        self.get(name)
+        for instance_num in instances:
+            self.assignment[instance_num] = name
+
+    def for_instance(self, instance_num=None):
+        """
+        :param instance_num: PX4实例编号，None表示默认任务
+        :return: 该实例要飞的PX4MissionPlan
+        """
+        if instance_num in self.assignment:
+            return self.plans[self.assignment[instance_num]]
+        if instance_num is not None and self.rotation:
+            return self.plans[self.rotation[instance_num % len(self.rotation)]]
+        return self.plans[self.default]
+
+    def mission_count(self, instance_num=None):
+        """实例任务的航点数量"""
+        return len(self.for_instance(instance_num))
@@ -0,0 +1,357 @@
+import abc
+import argparse
+import json
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import numpy as np
+import yaml
+
+
+def load_param_space(param_files):
+    """
+    读取参数文件中各参数的取值范围、步长和默认值，顺序与PX4Param写入参数的顺序一致。
+
+    :param param_files: 参数文件路径
+    :return: (参数名列表, 下界数组, 上界数组, 步长数组, 默认值数组)
+    """
+    with open(param_files, 'r') as file:
+        params = json.load(file)
+    names = list(params.keys())
+    lower = np.array([params[name]["range"][0] for name in names], dtype=float)
+    upper = np.array([params[name]["range"][1] for name in names], dtype=float)
+    step = np.array([params[name].get("step", 0.0) for name in names], dtype=float)
+    default = np.array([params[name]["default"] for name in names], dtype=float)
+    return names, lower, upper, step, default
+
+
+class PX4Strategy(abc.ABC):
+    """
+    参数搜索策略的基类，按 ask/tell 方式工作，得分越低越好。
+
+    ask() 随时可以调用，不要求上一个候选已经评估完，tell() 按评估完成的顺序回报得分，
+    因此多个候选可以同时在不同实例上评估。候选先裁剪到取值范围再按步长取整。
+    """
+
+    def __init__(self, lower, upper, step=None, x0=None, seed=None):
+        """
+        :param lower: 各参数下界
+        :param upper: 各参数上界
+        :param step: 各参数步长，0表示连续取值
+        :param x0: 初始参数，默认为范围中点
+        :param seed: 随机数种子
+        """
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.step = np.zeros_like(self.lower) if step is None else np.asarray(step, dtype=float)
+        self.x0 = (self.lower + self.upper) / 2 if x0 is None else np.asarray(x0, dtype=float)
+        self.rng = np.random.default_rng(seed)
+        self.best_x = None
+        self.best_score = math.inf
+        self.told = 0
+
+    def clip(self, x):
+        """裁剪到取值范围并按步长取整"""
+        x = np.clip(x, self.lower, self.upper)
+        quantized = self.step > 0
+        x[quantized] = self.lower[quantized] + np.round((x[quantized] - self.lower[quantized]) / self.step[quantized]) * self.step[quantized]
+        return np.clip(x, self.lower, self.upper)
+
+    @abc.abstractmethod
+    def ask(self):
+        """:return: 下一个要评估的候选参数"""
+
+    @abc.abstractmethod
+    def tell(self, x, score):
+        """
+        回报一个候选的得分，nan（评估失败）按最差处理。子类在自己的更新之前先调用本方法记录最优候选。
+
+        :return: 用于排序的得分
+        """
+        score = math.inf if score is None or math.isnan(score) else score
+        self.told += 1
+        if score < self.best_score:
+            self.best_score = score
+            self.best_x = np.array(x)
+        return score
+
+
+class PX4RandomSearch(PX4Strategy):
+    """在取值范围内均匀随机采样"""
+
+    def ask(self):
+        return self.clip(self.rng.uniform(self.lower, self.upper))
+
+    def tell(self, x, score):
+        return super().tell(x, score)
+
+
+class PX4CMAESStrategy(PX4Strategy):
+    """
+    CMA-ES风格的策略：从多元正态分布采样，每收到 popsize 个得分就用其中最好的 mu 个
+    更新均值、协方差（rank-one + rank-mu）和步长。
+
+    得分按完成顺序收集，不必等同一代的候选全部评估完；更新时也使用更新之前分布采样的候选，
+    搜索在归一化到[0, 1]的参数空间中进行。
+    """
+
+    def __init__(self, lower, upper, step=None, x0=None, seed=None, popsize=None, sigma=0.3):
+        """
+        :param popsize: 每次更新使用的候选数，默认为 4 + 3ln(n)
+        :param sigma: 归一化空间中的初始步长
+        """
+        super().__init__(lower, upper, step, x0, seed)
+        n = len(self.lower)
+        self.scale = np.where(self.upper > self.lower, self.upper - self.lower, 1.0)
+        self.popsize = popsize or 4 + int(3 * math.log(n))
+        self.mu = self.popsize // 2
+        weights = math.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1.0 / np.sum(self.weights ** 2)
+        # 标准的CMA-ES学习率
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0.0, math.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+        self.mean = (self.x0 - self.lower) / self.scale
+        self.sigma = sigma
+        self.cov = np.eye(n)
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self._decompose()
+        # 已回报、尚未用于更新的 (归一化候选, 得分)
+        self.results = []
+
+    def _decompose(self):
+        eigenvalues, self.eigenvectors = np.linalg.eigh(self.cov)
+        self.eigen_sqrt = np.sqrt(np.maximum(eigenvalues, 1e-20))
+
+    def ask(self):
+        z = self.rng.standard_normal(len(self.mean))
+        y = self.eigenvectors @ (self.eigen_sqrt * z)
+        return self.clip(self.lower + (self.mean + self.sigma * y) * self.scale)
+
+    def tell(self, x, score):
+        score = super().tell(x, score)
+        self.results.append(((np.asarray(x, dtype=float) - self.lower) / self.scale, score))
+        if len(self.results) >= self.popsize:
+            self._update()
+        return score
+
+    def _update(self):
+        self.results.sort(key=lambda result: result[1])
+        selected = np.array([u for u, _ in self.results[:self.mu]])
+        self.results = []
+        old_mean = self.mean
+        self.mean = self.weights @ selected
+        y = (selected - old_mean) / self.sigma
+        y_mean = (self.mean - old_mean) / self.sigma
+
+        inv_sqrt = self.eigenvectors @ np.diag(1 / self.eigen_sqrt) @ self.eigenvectors.T
+        self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * inv_sqrt @ y_mean
+        self.pc = (1 - self.cc) * self.pc + math.sqrt(self.cc * (2 - self.cc) * self.mueff) * y_mean
+        rank_mu = (self.weights[:, None] * y).T @ y
+        self.cov = (1 - self.c1 - self.cmu) * self.cov + self.c1 * np.outer(self.pc, self.pc) + self.cmu * rank_mu
+        self.cov = (self.cov + self.cov.T) / 2
+        self.sigma *= math.exp((self.cs / self.damps) * (np.linalg.norm(self.ps) / self.chi_n - 1))
+        self.sigma = min(self.sigma, 1.0)
+        self._decompose()
+
+
+class PX4GAStrategy(PX4Strategy):
+    """
+    稳态遗传算法：种群未满时随机采样，之后锦标赛选出两个父代，
+    逐维混合交叉并加高斯变异；回报的候选比种群中最差的个体好时替换它。
+    """
+
+    def __init__(self, lower, upper, step=None, x0=None, seed=None, popsize=32, mutation=0.1, tournament=3):
+        """
+        :param popsize: 种群大小
+        :param mutation: 高斯变异的标准差（相对于取值范围）
+        :param tournament: 锦标赛选择的参赛个体数
+        """
+        super().__init__(lower, upper, step, x0, seed)
+        self.popsize = popsize
+        self.mutation = mutation
+        self.tournament = tournament
+        self.population = np.empty((0, len(self.lower)))
+        self.scores = np.empty(0)
+
+    def _select(self):
+        candidates = self.rng.integers(len(self.scores), size=self.tournament)
+        return self.population[candidates[np.argmin(self.scores[candidates])]]
+
+    def ask(self):
+        if len(self.scores) < self.popsize:
+            if len(self.scores) == 0:
+                return self.clip(self.x0.copy())
+            return self.clip(self.rng.uniform(self.lower, self.upper))
+        parent_a, parent_b = self._select(), self._select()
+        alpha = self.rng.uniform(-0.25, 1.25, size=len(self.lower))
+        child = parent_a + alpha * (parent_b - parent_a)
+        child += self.rng.standard_normal(len(self.lower)) * self.mutation * (self.upper - self.lower)
+        return self.clip(child)
+
+    def tell(self, x, score):
+        score = super().tell(x, score)
+        if len(self.scores) < self.popsize:
+            self.population = np.vstack([self.population, x])
+            self.scores = np.append(self.scores, score)
+        else:
+            worst = np.argmax(self.scores)
+            if score < self.scores[worst]:
+                self.population[worst] = x
+                self.scores[worst] = score
+        return score
+
+
+STRATEGIES = {
+    "random": PX4RandomSearch,
+    "cmaes": PX4CMAESStrategy,
+    "ga": PX4GAStrategy,
+}
+
+
+class PX4Optimizer:
+    """
+    异步优化驱动：始终保持 max_pending 个候选在评估中，任一候选评估完成就回报得分并提交新候选，
+    不等待整代候选同步完成，使实例一直处于忙碌状态。
+
+    evaluator 需要提供 submit_nowait(param_values)，返回结果为得分的 concurrent.futures.Future，
+    例如 PX4EvalServer。max_evals 限制的是候选数；启用重复评估时一个候选对应多次飞行，
+    飞行次数和吞吐量取自评估器的 evaluations 计数（没有该计数时与候选数相同）。
+    """
+
+    def __init__(self, evaluator, strategy, max_pending, report_interval=60.0):
+        """
+        :param evaluator: 评估器
+        :param strategy: PX4Strategy
+        :param max_pending: 同时评估的候选数，一般为常驻实例数量
+        :param report_interval: 输出进度的间隔（秒）
+        """
+        self.evaluator = evaluator
+        self.strategy = strategy
+        self.max_pending = max_pending
+        self.report_interval = report_interval
+        # (参数, 得分) 历史，按完成顺序
+        self.history = []
+        self.failed = 0
+        self.elapsed = 0.0
+        # 开始时评估器已完成的飞行次数
+        self.flights_start = self._evaluator_flights()
+
+    def _evaluator_flights(self):
+        return getattr(self.evaluator, "evaluations", len(self.history))
+
+    def flights(self):
+        """本次优化实际飞行的次数"""
+        return self._evaluator_flights() - self.flights_start
+
+    def candidates_per_hour(self):
+        return len(self.history) / self.elapsed * 3600 if self.elapsed > 0 else 0.0
+
+    def flights_per_hour(self):
+        return self.flights() / self.elapsed * 3600 if self.elapsed > 0 else 0.0
+
+    def run(self, max_evals=None, max_seconds=None):
+        """
+        运行优化，直到评估完 max_evals 个候选或超过 max_seconds 秒。
+
+        :return: (最优参数, 最优得分)
+        """
+        start_time = time.perf_counter()
+        last_report = start_time
+        pending = {}
+        submitted = 0
+
+        def can_submit():
+            if max_evals is not None and submitted >= max_evals:
+                return False
+            return max_seconds is None or time.perf_counter() - start_time < max_seconds
+
+        while True:
+            while len(pending) < self.max_pending and can_submit():
+                x = self.strategy.ask()
+                pending[self.evaluator.submit_nowait(x.tolist())] = x
+                submitted += 1
+            if not pending:
+                break
+            done, _ = wait(list(pending), timeout=self.report_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                x = pending.pop(future)
+                try:
+                    score = future.result()
+                except Exception as e:
+                    print(f"评估出错: {e}")
+                    score = float("nan")
+                if score is None or math.isnan(score):
+                    self.failed += 1
+                self.strategy.tell(x, score)
+                self.history.append((x, score))
+
+            now = time.perf_counter()
+            self.elapsed = now - start_time
+            if now - last_report >= self.report_interval:
+                self.report()
+                last_report = now
+
+        self.elapsed = time.perf_counter() - start_time
+        self.report()
+        return self.strategy.best_x, self.strategy.best_score
+
+    def report(self):
+        """输出候选数、飞行次数、吞吐量和当前最优得分"""
+        print(f"已评估 {len(self.history)} 个候选（失败 {self.failed} 个），飞行 {self.flights()} 次，耗时 {self.elapsed:.1f} 秒，"
+              f"{self.candidates_per_hour():.0f} 候选/小时，{self.flights_per_hour():.0f} 次飞行/小时，"
+              f"当前最优得分 {self.strategy.best_score:.6f}")
+
+
+def main():
+    # 与PX4EvalServer相同，需在仓库根目录下运行
+    from PX4EvalServer import PX4EvalServer
+    from PX4ReplicateEvaluator import PX4ReplicateEvaluator
+
+    with open("./Cptool/config.yaml", "r") as f:
+        config = yaml.load(f.read(), Loader=yaml.FullLoader)
+    optimizer_config = config.get("optimizer", {})
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--strategy", choices=list(STRATEGIES), default=optimizer_config.get("strategy", "cmaes"))
+    parser.add_argument("--max_evals", type=int, help="评估的候选数（不是飞行次数）", default=optimizer_config.get("max_evals", 1000))
+    parser.add_argument("--max_seconds", type=float, default=optimizer_config.get("max_seconds"))
+    parser.add_argument("--pool_size", type=int, help="常驻实例个数", default=config["simulation"]["instance_count"])
+    parser.add_argument("--seed", type=int, default=optimizer_config.get("seed"))
+    args = parser.parse_args()
+
+    names, lower, upper, step, default = load_param_space(config["param_files"]["px4"])
+    strategy = STRATEGIES[args.strategy](lower, upper, step, x0=default, seed=args.seed,
+                                         **optimizer_config.get(args.strategy, {}))
+
+    px4EvalServer = PX4EvalServer(args.pool_size)
+    if config.get("replicates", {}).get("count", 1) > 1:
+        px4EvalServer.replicates = PX4ReplicateEvaluator.from_config(config)
+    px4EvalServer.start()
+    try:
+        max_pending = len(px4EvalServer.instances)
+        if px4EvalServer.replicates is not None:
+            # 每个候选每轮占用min_count个实例
+            max_pending = max(1, math.ceil(max_pending / px4EvalServer.replicates.min_count))
+        optimizer = PX4Optimizer(px4EvalServer, strategy, max_pending, optimizer_config.get("report_interval", 60.0))
+        best_x, best_score = optimizer.run(args.max_evals, args.max_seconds)
+    finally:
+        px4EvalServer.stop()
+    if px4EvalServer.replicates is not None:
+        px4EvalServer.replicates.report()
+
+    print(f"最优得分: {best_score}")
+    if best_x is not None:
+        for name, value in zip(names, best_x):
+            print(f"  {name}: {value:g}")
+
+
+if __name__ == "__main__":
+    main()
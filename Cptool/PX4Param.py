@@ -1,50 +1,147 @@
 from pymavlink import mavutil
-import time
 import json  # 导入json模块以读取文件
-import multiprocessing
+import math
 import argparse
+import asyncio
 
 # 读取配置文件
 import yaml
 
+from PX4MavMux import PX4MavMux
+
 
     
 class PX4Param:
-    def __init__(self,instance_count,base_port,param_files):
+    def __init__(self,instance_count,base_port,param_files,link_pool=None,window_size=14,ack_timeout=0.3,retries=5,heartbeat_timeout=10.0):
+        """
+        :param instance_count: PX4实例的数量
+        :param base_port: 基础端口号
+        :param param_files: 参数描述文件
+        :param link_pool: 共享的PX4LinkPool，为None时自行绑定端口
+        :param window_size: 每个实例同时等待确认的PARAM_SET数量
+        :param ack_timeout: 等待PARAM_VALUE回显的超时时间（秒），超时后重发未确认的参数
+        :param retries: 未确认参数的最大重发轮数
+        :param heartbeat_timeout: 等待心跳的超时时间（秒）
+        """
         self.instance_count = instance_count
         self.base_port = base_port
+        self.link_pool = link_pool
+        self.window_size = window_size
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self.heartbeat_timeout = heartbeat_timeout
         # 从文件中读取参数信息
         
         with open(param_files, 'r') as file:
             self.param_names = list(json.load(file).keys())
         # print(self.param_names)
         
+    def _send_param(self, master, param_name, param_value):
+        # 发送PARAM_SET消息来设置参数
+        master.mav.param_set_send(
+            master.target_system,
+            master.target_component,
+            param_name.encode('utf-8'),
+            param_value,
+            mavutil.mavlink.MAV_PARAM_TYPE_REAL32
+        )
+        # print(f"参数 {param_name} 修改为: {param_value}")
+
+    def _value_matches(self, echo_value, param_value):
+        """PARAM_VALUE中的值是float32，按float32精度比较"""
+        return math.isclose(echo_value, param_value, rel_tol=1e-6, abs_tol=1e-6)
+
     def change_single_params(self,instance_num,param_values):
-        
-        master = mavutil.mavlink_connection(f"udp:127.0.0.1:{self.base_port+instance_num}")
-        master.wait_heartbeat()
-        # print(instance_num)
-        for param_name, param_value in zip(self.param_names,param_values):
-            # 发送MAV_CMD_DO_SET_MODE命令来设置参数
-            master.mav.param_set_send(
-                master.target_system,
-                master.target_component,
-                param_name.encode('utf-8'),
-                param_value,
-                mavutil.mavlink.MAV_PARAM_TYPE_REAL32
-            )
-            # print(f"参数 {param_name} 修改为: {param_value}")
-            # 等待一段时间以确保参数已设置
-            time.sleep(0.1)
-
-    def change_multiple_params(self, param_group):
-        instances = (range(self.instance_count))
-
-        args = zip(instances, param_group)
-        # 并行执行计算得分函数
-        with multiprocessing.Pool() as pool:
-            pool.starmap(self.change_single_params, args)
-            # pool.join()   # 等待所有任务完成
+        """
+        修改单个实例的参数。
+
+        :return: 参数确认报告 {参数名: 确认的值，未确认为None}
+        """
+        return self.change_multiple_params([param_values], [instance_num])[0]
+
+    async def change_single_params_async(self, link, param_values):
+        """
+        以滑动窗口发送PARAM_SET，按PARAM_VALUE回显确认，只重发缺失或值不对的参数。
+
+        :param link: PX4MavLink链路
+        :param param_values: 参数值列表，与self.param_names顺序一致
+        :return: 参数确认报告 {参数名: 确认的值，未确认为None}
+        """
+        params = dict(zip(self.param_names, param_values))
+        confirmed = {}
+        if not await link.wait_heartbeat(self.heartbeat_timeout):
+            return {param_name: None for param_name in params}
+
+        loop = asyncio.get_running_loop()
+        queue = link.subscribe("PARAM_VALUE")
+        try:
+            for attempt in range(self.retries + 1):
+                to_send = [param_name for param_name in params if param_name not in confirmed]
+                if not to_send:
+                    break
+                in_flight = set()
+                while to_send and len(in_flight) < self.window_size:
+                    param_name = to_send.pop(0)
+                    self._send_param(link, param_name, params[param_name])
+                    in_flight.add(param_name)
+
+                # 收集回显，每确认一个就补发窗口中的下一个
+                deadline = loop.time() + self.ack_timeout
+                while in_flight:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        msg = await asyncio.wait_for(queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    param_name = msg.param_id
+                    if param_name not in in_flight or not self._value_matches(msg.param_value, params[param_name]):
+                        continue
+                    confirmed[param_name] = msg.param_value
+                    in_flight.discard(param_name)
+                    if to_send:
+                        param_name = to_send.pop(0)
+                        self._send_param(link, param_name, params[param_name])
+                        in_flight.add(param_name)
+                        deadline = loop.time() + self.ack_timeout
+        finally:
+            link.unsubscribe(queue)
+        return {param_name: confirmed.get(param_name) for param_name in params}
+
+    async def _change_params_on_links(self, links, param_group):
+        return await asyncio.gather(*(
+            self.change_single_params_async(link, param_values) for link, param_values in zip(links, param_group)
+        ))
+
+    async def _change_multiple_params_async(self, instances, param_group):
+        if self.link_pool is not None:
+            links = await self.link_pool.open(instances)
+            return await self._change_params_on_links(links, param_group)
+        async with PX4MavMux(instances, self.base_port, msg_types=["HEARTBEAT", "PARAM_VALUE"]) as mux:
+            return await self._change_params_on_links([mux.links[instance] for instance in instances], param_group)
+
+    def change_multiple_params(self, param_group, instances=None):
+        """
+        在一个事件循环中修改所有实例的参数。
+
+        :param param_group: 每个实例的参数值列表
+        :param instances: PX4实例编号列表，默认为 0..instance_count-1
+        :return: 每个实例的参数确认报告列表
+        """
+        if instances is None:
+            instances = list(range(self.instance_count))
+
+        # 有共享链路时在链路的事件循环中修改，否则临时绑定端口
+        if self.link_pool is not None:
+            reports = self.link_pool.run(self._change_multiple_params_async(instances, param_group))
+        else:
+            reports = asyncio.run(self._change_multiple_params_async(instances, param_group))
+
+        failed = [instance for instance, report in zip(instances, reports) if None in report.values()]
+        if failed:
+            print(f"以下实例存在未确认的参数: {failed}")
+        return reports
 
 if __name__ == "__main__":
     with open("./Cptool/config.yaml", "r") as f:
@@ -0,0 +1,191 @@
+import glob
+import os
+import time
+
+import numpy as np
+
+
+def parse_cpulist(cpulist):
+    """
+    解析内核的CPU列表格式，例如 "0-3,8-11"。
+
+    :return: CPU编号列表
+    """
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes(cpus=None):
+    """
+    读取NUMA节点及其CPU，只保留当前进程允许使用的CPU。
+
+    :param cpus: 进一步限制可用的CPU编号（例如launcher配置的cpus），None表示不限制
+    :return: 每个节点的CPU编号列表，没有NUMA信息时视为单个节点
+    """
+    allowed = os.sched_getaffinity(0)
+    if cpus:
+        allowed = allowed & set(cpus)
+    nodes = []
+    for node_dir in sorted(glob.glob("/sys/devices/system/node/node[0-9]*"), key=lambda d: int(d.rsplit("node", 1)[1])):
+        try:
+            with open(f"{node_dir}/cpulist", "r") as f:
+                cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in allowed]
+        except OSError:
+            continue
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(allowed)]
+
+
+class PX4Placement:
+    """
+    PX4实例与Python编排进程的CPU放置策略。
+
+    共 reserved 个CPU留给评分、参数、任务等Python编排工作：从第一个节点开始依次取各节点的前几个CPU，
+    取满为止，每个节点至少保留一个CPU给实例。其余CPU分给px4实例。
+    实例按编号依次分配CPU，各节点的CPU交替排列，使实例均匀分布到各节点；
+    mode 为 core 时每个实例固定在一个CPU上，为 node 时实例可以在所属节点的实例CPU间迁移。
+    实例的CPU集合由 PX4SihSim 以 taskset 命令前缀设置。
+    """
+
+    def __init__(self, enabled=False, reserved=2, mode="core", nodes=None, cpus=None):
+        """
+        :param enabled: 是否启用放置策略
+        :param reserved: 留给Python编排进程的CPU总数（不是每个节点的数量），从第一个节点开始取
+        :param mode: core（每个实例一个CPU）或 node（每个实例一个节点）
+        :param nodes: 每个NUMA节点的CPU列表，默认从/sys读取
+        :param cpus: 只在这些CPU上放置（launcher配置的cpus），None表示当前进程允许的全部CPU
+        """
+        self.enabled = enabled
+        self.mode = mode
+        if nodes is None:
+            nodes = numa_nodes(cpus)
+        elif cpus:
+            nodes = [[cpu for cpu in node if cpu in set(cpus)] for node in nodes]
+            nodes = [node for node in nodes if node]
+        if enabled and not nodes:
+            raise ValueError(f"launcher.cpus {cpus} 与当前进程允许的CPU没有交集")
+
+        # 编排进程的CPU从第一个节点开始预留，只有一个CPU的节点不预留
+        self.reserved_cpus = []
+        self.instance_nodes = []
+        remaining = reserved
+        for cpus in nodes:
+            take = min(remaining, len(cpus) - 1)
+            self.reserved_cpus.extend(cpus[:take])
+            self.instance_nodes.append(cpus[take:])
+            remaining -= take
+
+        # 实例CPU的分配顺序：各节点轮流取一个CPU，节点CPU数不同时按CPU数均摊实例
+        self.order = []
+        for position in range(max((len(node) for node in self.instance_nodes), default=0)):
+            for node_index, node in enumerate(self.instance_nodes):
+                if position < len(node):
+                    self.order.append((node[position], node_index))
+
+    @classmethod
+    def from_config(cls, config):
+        """从config.yaml的placement配置中创建放置策略"""
+        placement_config = config.get("placement", {})
+        return cls(
+            placement_config.get("enabled", False),
+            placement_config.get("reserved", 2),
+            placement_config.get("mode", "core"),
+            cpus=(config.get("launcher") or {}).get("cpus") or None,
+        )
+
+    def cpus_for(self, instance_num):
+        """
+        :param instance_num: PX4实例编号
+        :return: 该实例可以运行的CPU集合，未启用时返回None
+        """
+        if not self.enabled or not self.order:
+            return None
+        cpu, node_index = self.order[instance_num % len(self.order)]
+        if self.mode == "node":
+            return set(self.instance_nodes[node_index])
+        return {cpu}
+
+    def pin_orchestrator(self, pid=None):
+        """
+        把编排进程的所有线程固定在预留的CPU上，之后创建的线程和子进程都会继承。
+
+        :param pid: 进程PID，默认为当前进程
+        """
+        if not self.enabled or not self.reserved_cpus:
+            return
+        pid = pid or os.getpid()
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            try:
+                os.sched_setaffinity(int(tid), self.reserved_cpus)
+            except OSError:
+                pass
+
+    def unpin_orchestrator(self, pid=None):
+        """恢复编排进程可以在所有CPU上运行"""
+        pid = pid or os.getpid()
+        cpus = self.reserved_cpus + [cpu for node in self.instance_nodes for cpu in node]
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            try:
+                os.sched_setaffinity(int(tid), cpus)
+            except OSError:
+                pass
+
+    def __repr__(self):
+        return (f"PX4Placement(enabled={self.enabled}, mode={self.mode}, reserved={self.reserved_cpus}, "
+                f"nodes={[len(node) for node in self.instance_nodes]})")
+
+
+def benchmark(instance_count=100, rounds=3):
+    """
+    比较启用与不启用CPU放置时的得分方差和吞吐量。所有实例使用相同的参数，
+    得分的标准差反映时序抖动带来的噪声。需在仓库根目录下运行。
+
+    :param instance_count: 每轮的实例数量
+    :param rounds: 每种设置的轮数
+    :return: {设置: {std, throughput, failed}}
+    """
+    from PX4SihMain import PX4SihMain
+
+    param_values = [9.8, 9.4, 0.1, 0.1, 1.0, 0.6, 0.6, 0.02, 0.01, 89.0, 4.0, 3.0, 1.7, 4.8]
+    px4SihMain = PX4SihMain()
+    # 每轮都要实际飞行，不使用结果缓存
+    px4SihMain.resultCache = None
+    results = {}
+    try:
+        for enabled in (False, True):
+            px4SihMain.placement.enabled = enabled
+            stds, throughputs, failed = [], [], []
+            for _ in range(rounds):
+                start_time = time.perf_counter()
+                scores = np.array(px4SihMain.TestParam([param_values] * instance_count))
+                throughputs.append(instance_count / (time.perf_counter() - start_time))
+                stds.append(np.nanstd(scores))
+                failed.append(int(np.isnan(scores).sum()))
+            name = "pinned" if enabled else "unpinned"
+            results[name] = {
+                "std": float(np.mean(stds)),
+                "throughput": float(np.mean(throughputs)),
+                "failed": float(np.mean(failed)),
+            }
+            px4SihMain.placement.unpin_orchestrator()
+    finally:
+        px4SihMain.link_pool.close()
+
+    print(px4SihMain.placement)
+    for name, result in results.items():
+        print(f"{name}: 得分标准差 {result['std']:.4f}，吞吐量 {result['throughput']:.2f} 实例/秒，"
+              f"失败 {result['failed']:.1f}")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
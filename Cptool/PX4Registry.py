@@ -0,0 +1,102 @@
+import os
+
+
+class PX4ProcessRecord:
+    """单个PX4实例的进程信息"""
+
+    def __init__(self, instance_num, pid, port=None, working_dir=None, source="launch"):
+        """
+        :param instance_num: PX4实例编号
+        :param pid: px4进程PID
+        :param port: 该实例评分/通信使用的地面站端口
+        :param working_dir: px4工作目录
+        :param source: PID来源，launch（启动）或 restore（CRIU恢复）
+        """
+        self.instance_num = instance_num
+        self.pid = pid
+        self.port = port
+        self.working_dir = working_dir
+        self.source = source
+
+    def __repr__(self):
+        return f"PX4ProcessRecord(instance={self.instance_num}, pid={self.pid}, port={self.port}, source={self.source})"
+
+
+class PX4Registry:
+    """
+    PX4实例的进程登记表：实例编号 → PID/端口/工作目录。
+
+    PID在启动时（subprocess.Popen）或CRIU恢复时（--pidfile）登记，
+    查找不再需要扫描 ps 的输出。
+    """
+
+    def __init__(self, base_port=None):
+        """
+        :param base_port: 实例端口的基础端口号，实例端口为 base_port + 实例编号
+        """
+        self.base_port = base_port
+        self.records = {}
+
+    def register(self, instance_num, pid, working_dir=None, source="launch"):
+        """
+        登记（或更新）一个实例的进程。
+
+        :return: 登记后的记录
+        """
+        port = self.base_port + instance_num if self.base_port is not None else None
+        record = PX4ProcessRecord(instance_num, pid, port, working_dir, source)
+        self.records[instance_num] = record
+        return record
+
+    def unregister(self, instance_num):
+        return self.records.pop(instance_num, None)
+
+    def get(self, instance_num):
+        return self.records.get(instance_num)
+
+    def pid(self, instance_num):
+        record = self.records.get(instance_num)
+        return record.pid if record is not None else None
+
+    def pids(self, instances=None):
+        """
+        :param instances: 实例编号列表，None表示全部已登记实例
+        :return: {实例编号: PID}
+        """
+        if instances is None:
+            instances = sorted(self.records)
+        return {instance_num: self.records[instance_num].pid for instance_num in instances if instance_num in self.records}
+
+    def is_alive(self, instance_num):
+        """进程是否仍然存在（以root恢复的进程无权发信号时也视为存在）"""
+        pid = self.pid(instance_num)
+        if pid is None:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def kill(self, instances=None):
+        """
+        杀掉一组实例的进程并注销。
+
+        :param instances: 实例编号列表，None表示全部已登记实例
+        """
+        pids = self.pids(instances)
+        if pids:
+            os.system(f"sudo kill -9 {' '.join(str(pid) for pid in pids.values())} 2>/dev/null")
+        for instance_num in pids:
+            self.unregister(instance_num)
+
+    def clear(self):
+        self.records = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, instance_num):
+        return instance_num in self.records
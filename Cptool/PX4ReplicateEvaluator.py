@@ -0,0 +1,123 @@
+import asyncio
+import math
+
+import numpy as np
+
+
+def mean_halfwidth(scores, z=1.96):
+    """
+    :param scores: 有效得分列表
+    :param z: 置信区间的z值，1.96对应95%
+    :return: (均值, 置信区间半宽)，只有一个得分时半宽为inf
+    """
+    n = len(scores)
+    if n == 0:
+        return float("nan"), math.inf
+    mean = float(np.mean(scores))
+    if n < 2:
+        return mean, math.inf
+    return mean, z * float(np.std(scores, ddof=1)) / math.sqrt(n)
+
+
+class PX4ReplicateEvaluator:
+    """
+    多次重复评估同一组参数，以均值作为得分，降低单个评分窗口的噪声。
+
+    每组参数先评估 min_count 次，之后每次追加 min_count 次，直到 count 次；
+    每轮结束后若得分置信区间的下界已经高于当前最优得分（得分越低越好），说明该参数明显更差，
+    不再追加评估，省下的实例时间留给其他候选。评估全部完成的候选才会更新当前最优得分。
+    """
+
+    def __init__(self, count=4, min_count=2, z=1.96):
+        """
+        :param count: 每组参数最多评估的次数
+        :param min_count: 开始判断提前淘汰前的评估次数，也是每轮追加的次数
+        :param z: 置信区间的z值
+        """
+        self.count = count
+        self.min_count = max(1, min(min_count, count))
+        self.z = z
+        self.best_score = math.inf
+        # 统计
+        self.candidates = 0
+        self.rejected = 0
+        self.evaluations = 0
+        self.evaluations_saved = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """从config.yaml的replicates配置中创建"""
+        replicates_config = config.get("replicates", {})
+        return cls(replicates_config.get("count", 4), replicates_config.get("min_count", 2),
+                   replicates_config.get("z", 1.96))
+
+    def _clearly_worse(self, scores):
+        mean, halfwidth = mean_halfwidth(scores, self.z)
+        return len(scores) >= 2 and mean - halfwidth > self.best_score
+
+    def _finish(self, scores, launched, rejected):
+        """记录一个候选的评估结果，返回 (均值, 半宽, 评估次数, 是否被淘汰)"""
+        mean, halfwidth = mean_halfwidth(scores, self.z)
+        self.candidates += 1
+        self.evaluations += launched
+        if rejected:
+            self.rejected += 1
+            self.evaluations_saved += self.count - launched
+        elif scores and mean < self.best_score:
+            self.best_score = mean
+        return mean, halfwidth, launched, rejected
+
+    async def evaluate_async(self, evaluate, param_values):
+        """
+        在常驻实例上重复评估一组参数，每轮的各次评估并发执行。
+
+        :param evaluate: 协程函数 evaluate(param_values)，返回一次评估的得分，例如 PX4EvalServer.evaluate_async
+        :param param_values: 参数值列表
+        :return: (均值, 半宽, 评估次数, 是否被淘汰)，全部失败时均值为nan
+        """
+        scores = []
+        launched = 0
+        while launched < self.count:
+            batch = min(self.min_count, self.count - launched)
+            results = await asyncio.gather(*(evaluate(param_values) for _ in range(batch)))
+            launched += batch
+            scores.extend(score for score in results if not math.isnan(score))
+            if launched < self.count and self._clearly_worse(scores):
+                return self._finish(scores, launched, True)
+        return self._finish(scores, launched, False)
+
+    def evaluate_group(self, evaluate_group, param_group):
+        """
+        以批量方式重复评估多组参数：每轮把所有未淘汰的候选各复制 min_count 份一起评估，
+        适用于一次评估一批参数的评估器，例如 PX4Rewind.evaluate 或关闭结果缓存的 PX4SihMain.TestParam。
+
+        :param evaluate_group: 函数 evaluate_group(param_group)，返回与输入顺序一致的得分列表
+        :param param_group: 参数值列表的列表
+        :return: 与param_group顺序一致的 (均值, 半宽, 评估次数, 是否被淘汰) 列表
+        """
+        scores = [[] for _ in param_group]
+        launched = [0] * len(param_group)
+        active = list(range(len(param_group)))
+        results = [None] * len(param_group)
+        while active:
+            batches = {index: min(self.min_count, self.count - launched[index]) for index in active}
+            flat = [index for index in active for _ in range(batches[index])]
+            for index, score in zip(flat, evaluate_group([param_group[index] for index in flat])):
+                if not math.isnan(score):
+                    scores[index].append(score)
+            still_active = []
+            for index in active:
+                launched[index] += batches[index]
+                if launched[index] >= self.count:
+                    results[index] = self._finish(scores[index], launched[index], False)
+                elif self._clearly_worse(scores[index]):
+                    results[index] = self._finish(scores[index], launched[index], True)
+                else:
+                    still_active.append(index)
+            active = still_active
+        return results
+
+    def report(self):
+        """输出淘汰的候选数和节省的评估次数"""
+        print(f"重复评估: {self.candidates}个候选，评估{self.evaluations}次，提前淘汰{self.rejected}个，"
+              f"节省{self.evaluations_saved}次评估，当前最优均值 {self.best_score:.6f}")
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+
+def build_fingerprint(px4_build_dir):
+    """
+    px4可执行文件的标识（路径、大小、修改时间），重新编译后缓存自动失效。
+
+    :param px4_build_dir: px4编译目录
+    """
+    px4_bin = f"{px4_build_dir}/bin/px4"
+    try:
+        stat = os.stat(px4_bin)
+    except OSError:
+        return px4_bin
+    return f"{px4_bin}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class PX4ResultCache:
+    """
+    持久化的评估结果缓存（SQLite）。
+
+    键由参数向量、任务航点、仿真速度、px4编译版本和评分配置共同决定。默认按完整精度比较参数，
+    只有完全相同的参数（例如优化器重复提出同一候选、重复实验）才会命中；
+    给出各参数的量化步长后，落在同一步长格点上的参数视为同一个候选，步长为0的参数仍按完整精度比较。
+    同一个键可以保存多次评估（重复实验）的得分；保存的得分数达到 replicates 后直接用其均值作答，
+    不再飞行。评估失败（nan）不写入缓存，下次会重新评估。
+    """
+
+    def __init__(self, path, replicates=1, lower=None, step=None):
+        """
+        :param path: SQLite数据库文件路径
+        :param replicates: 每个键需要的评估次数
+        :param lower: 各参数下界，量化格点的起点
+        :param step: 各参数的量化步长，None表示全部按完整精度比较
+        """
+        self.path = path
+        self.replicates = replicates
+        self.step = None if step is None else np.asarray(step, dtype=float)
+        if self.step is not None and not np.any(self.step > 0):
+            self.step = None
+        self.lower = None
+        if self.step is not None:
+            self.lower = np.zeros_like(self.step) if lower is None else np.asarray(lower, dtype=float)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # PX4EvalServer在链路事件循环线程中访问缓存，访问本身是串行的
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT NOT NULL, score REAL NOT NULL, params TEXT, created REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_key ON results (key)")
+        self.conn.commit()
+        # 本进程内的统计
+        self.flights = 0
+        self.flights_saved = 0
+
+    @classmethod
+    def from_config(cls, config, param_files=None):
+        """
+        从config.yaml的cache配置中创建结果缓存。
+
+        quantize 为 null 时按完整精度作键；为 param_file 时使用参数文件中各参数的 step；
+        为 {参数名: 步长} 时只量化列出的参数。量化格点从参数文件中的下界开始。
+
+        :param param_files: 参数文件路径，默认为配置中的 param_files.px4
+        """
+        # 延迟导入，避免与PX4Optimizer循环导入
+        from PX4Optimizer import load_param_space
+
+        cache_config = config.get("cache", {})
+        path = cache_config.get("path") or f"{config['paths']['root_dir']}/result_cache.sqlite"
+        quantize = cache_config.get("quantize")
+        lower = step = None
+        if quantize:
+            names, lower, _, param_step, _ = load_param_space(param_files or config["param_files"]["px4"])
+            if quantize == "param_file":
+                step = param_step
+            elif isinstance(quantize, dict):
+                unknown = set(quantize) - set(names)
+                if unknown:
+                    raise ValueError(f"cache.quantize 中有参数文件里没有的参数: {sorted(unknown)}")
+                step = [float(quantize.get(name, 0.0)) for name in names]
+            else:
+                raise ValueError(f"cache.quantize 应为 null、param_file 或 {{参数名: 步长}}: {quantize}")
+        return cls(path, cache_config.get("replicates", 1), lower, step)
+
+    def close(self):
+        self.conn.close()
+
+    def quantize(self, param_values):
+        """
+        参数向量的键表示：有量化步长的参数为格点序号，其余为完整精度的浮点数
+        （JSON按repr输出浮点数，-0.0与0.0视为相同）。
+        """
+        x = [float(v) + 0.0 for v in param_values]
+        if self.step is None:
+            return x
+        return [int(round((v - lo) / st)) if st > 0 else v for v, lo, st in zip(x, self.lower, self.step)]
+
+    def key(self, param_values, context):
+        """
+        :param param_values: 参数值列表
+        :param context: 影响得分的其他条件（任务、仿真速度、编译版本、评分配置），须可JSON序列化
+        :return: 缓存键
+        """
+        if self.step is None:
+            payload = [self.quantize(param_values), context]
+        else:
+            # 步长也进入键，修改步长后不会与之前的格点混用
+            payload = [self.quantize(param_values), context, self.step.tolist()]
+        payload = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def get(self, key):
+        """:return: 该键已保存的得分列表"""
+        return [row[0] for row in self.conn.execute("SELECT score FROM results WHERE key = ?", (key,))]
+
+    def put(self, key, score, param_values=None):
+        """保存一次评估的得分，nan不保存"""
+        if score is None or math.isnan(score):
+            return
+        params = None if param_values is None else json.dumps([float(v) for v in param_values])
+        self.conn.execute("INSERT INTO results VALUES (?, ?, ?, ?)", (key, float(score), params, time.time()))
+
+    def commit(self):
+        self.conn.commit()
+
+    def missing(self, keys):
+        """
+        找出需要飞行的参数组：每个键还差多少次评估，就从该键的参数组中取多少个。
+
+        :param keys: 每组参数的缓存键
+        :return: 需要飞行的参数组下标列表
+        """
+        stored = {key: len(self.get(key)) for key in set(keys)}
+        queued = {}
+        indices = []
+        for index, key in enumerate(keys):
+            if stored[key] + queued.get(key, 0) < self.replicates:
+                queued[key] = queued.get(key, 0) + 1
+                indices.append(index)
+        return indices
+
+    def scores(self, keys):
+        """
+        :param keys: 每组参数的缓存键
+        :return: 每组参数的得分（已保存得分的均值），没有得分为nan
+        """
+        means = {}
+        for key in set(keys):
+            stored = self.get(key)
+            means[key] = float(np.mean(stored)) if stored else float("nan")
+        return [means[key] for key in keys]
+
+    def lookup(self, key):
+        """
+        单个候选的查询，用于逐个提交候选的评估器（PX4EvalServer）。
+
+        :return: 已保存的得分数达到 replicates 时返回其均值，否则返回None
+        """
+        stored = self.get(key)
+        if len(stored) < self.replicates:
+            return None
+        self.flights_saved += 1
+        return float(np.mean(stored))
+
+    def record(self, total, flown):
+        """
+        记录一次批量评估中命中缓存的情况。
+
+        :param total: 参数组总数
+        :param flown: 实际飞行的次数
+        """
+        self.flights += flown
+        self.flights_saved += total - flown
+        print(f"结果缓存: {total}组参数中{total - flown}组直接作答，飞行{flown}次，累计节省{self.flights_saved}次飞行")
@@ -0,0 +1,192 @@
+import argparse
+import time
+
+import numpy as np
+import yaml
+
+from PX4Barrier import PX4Barrier, heartbeat_ready
+from PX4Criu import PX4Criu
+from PX4LinkPool import PX4LinkPool
+from PX4Param import PX4Param
+from PX4ReplicateEvaluator import PX4ReplicateEvaluator
+from PX4Score import PX4Score
+
+# 读取配置文件
+with open("./config.yaml", "r") as f:
+    config = yaml.load(f.read(), Loader=yaml.FullLoader)
+
+
+class PX4Rewind:
+    """
+    基于CRIU回溯的评估引擎。
+
+    每次评估把所有实例从镜像恢复到飞行中的稳定状态，写入一组参数并评分，
+    然后杀掉实例并恢复镜像和工作目录。每个候选参数都从相同的飞行状态开始，
+    省去起飞和上传任务的时间。镜像需事先由 make_multiple_px4_sih_checkpoint
+    或 make_golden_px4_sih_checkpoint 生成并 save_criu_imgs 保存。
+    """
+
+    def __init__(self, golden_num=None):
+        """
+        :param golden_num: 镜像由黄金实例生成时为黄金实例编号，否则为None
+        """
+        self.px4Criu = PX4Criu()
+        self.golden_num = golden_num
+        self.base_port = self.px4Criu.base_port
+        self.link_pool = PX4LinkPool(self.base_port)
+        self.evaluations = 0
+
+    def _restore_all(self, instances):
+        """
+        由criu调度器恢复一组实例，等待全部完成。
+
+        :return: {实例编号: 恢复出的px4进程PID}
+        """
+        self.px4Criu.restore_multiple_px4_proecss(instances, self.golden_num)
+        return self.px4Criu.registry.pids(instances)
+
+    def _restore_and_wait(self, instances):
+        """
+        恢复一组实例并等待心跳。
+
+        :return: 心跳就绪的实例编号列表
+        """
+        # 先清除旧心跳，避免把恢复前的状态当作就绪
+        self.link_pool.mark_restarted(instances)
+        pids = self._restore_all(instances)
+        if self.golden_num is not None:
+            # 由黄金镜像恢复的实例仍向黄金实例的端口发送，需要先通知其改向本实例端口
+            self.link_pool.announce(instances, 24000)
+        ready = PX4Barrier.from_config("restore", config).wait_links(
+            self.link_pool, [instance for instance in instances if instance in pids], heartbeat_ready
+        )
+        if self.golden_num is not None:
+            # 恢复出的实例共用黄金实例的系统ID，只能按端口区分，心跳必须来自本实例的端口
+            mismatched = self.link_pool.check_ports(ready, 24000)
+            if mismatched:
+                raise RuntimeError(f"实例{mismatched}的心跳不是来自各自的PX4端口")
+        return ready
+
+    def _rewind(self, instances):
+        self.px4Criu.registry.kill(instances)
+        self.px4Criu.stop_lazy_pages(instances)
+        self.px4Criu.recover_criu_imgs()
+
+    def benchmark_restore(self, instances, rounds=3):
+        """
+        在同一组镜像上比较完整恢复与延迟页面恢复（--lazy-pages）：
+        criu restore的耗时，以及从开始恢复到收到心跳的耗时。
+
+        :param instances: PX4实例编号列表
+        :param rounds: 每种模式的重复次数
+        :return: {模式: {restore, heartbeat, ready}}，时间为平均秒数
+        """
+        lazy_pages = self.px4Criu.lazy_pages
+        results = {}
+        try:
+            for mode in (False, True):
+                self.px4Criu.lazy_pages = mode
+                restore_times, heartbeat_times, ready_counts = [], [], []
+                for _ in range(rounds):
+                    start_time = time.perf_counter()
+                    self.link_pool.mark_restarted(instances)
+                    pids = self._restore_all(instances)
+                    restore_times.append(time.perf_counter() - start_time)
+                    if self.golden_num is not None:
+                        self.link_pool.announce(instances, 24000)
+                    ready = PX4Barrier("benchmark", config["barriers"]["restore"]["timeout"]).wait_links(
+                        self.link_pool, [instance for instance in instances if instance in pids], heartbeat_ready
+                    )
+                    heartbeat_times.append(time.perf_counter() - start_time)
+                    ready_counts.append(len(ready))
+                    self._rewind(instances)
+                name = "lazy" if mode else "eager"
+                results[name] = {
+                    "restore": float(np.mean(restore_times)),
+                    "heartbeat": float(np.mean(heartbeat_times)),
+                    "ready": float(np.mean(ready_counts)),
+                }
+        finally:
+            self.px4Criu.lazy_pages = lazy_pages
+
+        for name, result in results.items():
+            print(f"{name}: criu restore {result['restore']:.2f} 秒，首个心跳 {result['heartbeat']:.2f} 秒，"
+                  f"就绪 {result['ready']:.0f}/{len(instances)}")
+        return results
+
+    def evaluate(self, param_group):
+        """
+        恢复、写参数、评分、回溯。
+
+        :param param_group: 每个实例的参数值列表，实例数为len(param_group)
+        :return: 得分列表，失败为nan
+        """
+        instances = list(range(len(param_group)))
+        try:
+            ready = self._restore_and_wait(instances)
+
+            px4Param = PX4Param(len(instances), self.base_port, self.px4Criu.param_files, self.link_pool)
+            reports = dict(zip(ready, px4Param.change_multiple_params([param_group[i] for i in ready], ready)))
+            ready = [instance for instance in ready if None not in reports[instance].values()]
+
+            px4Score = PX4Score(len(instances), self.px4Criu.sim_speed, self.base_port, link_pool=self.link_pool,
+                                mission_count=self.px4Criu.px4Mission.library.mission_count, **config.get("score", {}))
+            scores = self.link_pool.run(px4Score.count_score_async(ready))
+            scores = dict(zip(ready, scores))
+        finally:
+            # 回溯：杀掉恢复出的实例，恢复镜像和工作目录
+            self._rewind(instances)
+        self.evaluations += len(instances)
+        return [scores.get(instance, float("nan")) for instance in instances]
+
+    def close(self):
+        self.link_pool.close()
+
+    def evaluate_replicated(self, param_group, replicates=None):
+        """
+        每组参数在多个回溯的实例上重复评估，得分取均值，明显差于当前最优的参数提前淘汰。
+        每轮评估的参数组数超过镜像实例数时分批评估。
+
+        :param param_group: 参数值列表的列表
+        :param replicates: PX4ReplicateEvaluator，默认按配置创建
+        :return: 与param_group顺序一致的 (均值, 半宽, 评估次数, 是否被淘汰) 列表
+        """
+        if replicates is None:
+            replicates = PX4ReplicateEvaluator.from_config(config)
+        instance_count = self.px4Criu.instance_count
+
+        def evaluate_group(group):
+            scores = []
+            for start in range(0, len(group), instance_count):
+                scores.extend(self.evaluate(group[start:start + instance_count]))
+            return scores
+
+        results = replicates.evaluate_group(evaluate_group, param_group)
+        replicates.report()
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instance_count", type=int, help="实例个数", default=config["simulation"]["instance_count"])
+    parser.add_argument("--benchmark", action="store_true", help="比较完整恢复与延迟页面恢复")
+    args = parser.parse_args()
+
+    instance_count = args.instance_count
+    param_values = [9.8, 9.4, 0.1, 0.1, 1.0, 0.6, 0.6, 0.02, 0.01, 89.0, 4.0, 3.0, 1.7, 4.8]
+
+    px4Rewind = PX4Rewind()
+    count = 0
+    try:
+        if args.benchmark:
+            px4Rewind.benchmark_restore(list(range(instance_count)))
+        else:
+            while True:
+                count += 1
+                start_time = time.perf_counter()
+                scores = px4Rewind.evaluate([param_values] * instance_count)
+                print(scores)
+                print("以下编号测试失败:", np.where(np.isnan(scores))[0])
+                print(f"第{count}轮 耗时: {time.perf_counter() - start_time:.4f} 秒")
+    finally:
+        px4Rewind.close()
@@ -3,26 +3,279 @@ import time
 import math
 import multiprocessing
 import argparse
+import asyncio
+import numpy as np
 import yaml
 
+from PX4MavMux import PX4MavMux
+from PX4ScoreArray import PX4ScoreArray, SCORE_FIELDS
 
-# 读取配置文件
-with open("config.yaml", "r") as f:
-    config = yaml.load(f.read(), Loader=yaml.FullLoader)
+
+# 一个采样需要的四种消息
+SAMPLE_TYPES = ["ATTITUDE", "ATTITUDE_TARGET", "POSITION_TARGET_LOCAL_NED", "LOCAL_POSITION_NED"]
+# 整个任务评分时用于划分航段和判断任务结束的消息
+MISSION_TYPES = ["MISSION_CURRENT", "MISSION_ITEM_REACHED"]
+
+
+class PX4ScoreWindow:
+    """
+    单个PX4实例的流式评分窗口。
+
+    每一帧只读取一次，保存四种消息各自的最新值；每当触发消息到达，
+    且四种最新消息的 time_boot_ms 与触发消息相差不超过 max_skew_ms 时，
+    组成一个对齐的采样，在向量化评分核心中累加差值。
+    同步的 _monitor_px4_state 和异步的 count_score 共用这一累加逻辑。
+
+    窗口长度按仿真时间（消息中的 time_boot_ms）计算，与主机负载无关：
+    仿真时间达到 window_ms 且采样数不少于 min_samples 时结束。
+    设置了 ci_halfwidth 时，采样得分均值的置信区间半宽不超过该值即提前结束。
+    """
+
+    def __init__(self, px4_score, score_array, row, msg_timeout=0.5):
+        """
+        :param px4_score: PX4Score对象，提供触发消息类型与对齐容差
+        :param score_array: 保存所有实例累加器的PX4ScoreArray
+        :param row: 该实例在score_array中的行
+        :param msg_timeout: 两个对齐采样之间的最长等待时间（秒）
+        """
+        self.px4_score = px4_score
+        self.score_array = score_array
+        self.row = row
+        self.msg_timeout = msg_timeout
+        self.trigger_type = px4_score.trigger_type
+        self.max_skew_ms = px4_score.max_skew_ms
+        # 四种消息各自的最新值
+        self.latest = {}
+        # 对齐成功与未对齐的触发次数
+        self.samples = 0
+        self.misaligned = 0
+        # 最近一次得到对齐采样的时间（墙上时间，只用于判断超时）
+        self.last_time = time.time()
+        # 第一个对齐采样的仿真时间（毫秒）
+        self.first_boot_ms = None
+        self.sim_elapsed_ms = 0
+        # 采样得分的在线均值和方差（Welford）
+        self.score_mean = 0.0
+        self.score_m2 = 0.0
+        self.timed_out = False
+        self.done = False
+
+    def feed(self, msg):
+        """
+        输入一条消息，触发消息到达且与其余三种消息时间对齐时累加一次差值。
+
+        :param msg: MAVLink消息
+        :return: 窗口是否已结束
+        """
+        if self.done:
+            return True
+        msg_type = msg.get_type()
+        if msg_type not in SAMPLE_TYPES:
+            return False
+        self.latest[msg_type] = msg
+        if msg_type != self.trigger_type:
+            return False
+        if len(self.latest) < len(SAMPLE_TYPES):
+            return False
+
+        # 按 time_boot_ms 对齐，而不是按到达顺序
+        trigger_ms = msg.time_boot_ms
+        if any(abs(trigger_ms - latest_msg.time_boot_ms) > self.max_skew_ms for latest_msg in self.latest.values()):
+            self.misaligned += 1
+            return False
+
+        # 写入当前状态和设定值并累加差值
+        self.score_array.set_state(self.row, self.latest["LOCAL_POSITION_NED"], self.latest["ATTITUDE"])
+        self.score_array.set_setpoint(self.row, self.latest["POSITION_TARGET_LOCAL_NED"], self.latest["ATTITUDE_TARGET"])
+        self.score_array.accumulate(self.row)
+        self.samples += 1
+        self.last_time = time.time()
+        if self.first_boot_ms is None:
+            self.first_boot_ms = trigger_ms
+        self.sim_elapsed_ms = trigger_ms - self.first_boot_ms
+
+        self._on_sample()
+        self.done = self._window_done()
+        return self.done
+
+    def _on_sample(self):
+        """每得到一个对齐采样后调用"""
+        if self.px4_score.ci_halfwidth is not None:
+            self._update_score_stats(float(self.score_array.sample_scores(self.row)[0]))
+
+    def _window_done(self):
+        """仿真时间达到窗口长度，或置信区间已足够窄，窗口结束"""
+        px4_score = self.px4_score
+        if self.samples < px4_score.min_samples:
+            return False
+        if self.sim_elapsed_ms >= px4_score.window_ms:
+            return True
+        return px4_score.ci_halfwidth is not None and self.ci_halfwidth() <= px4_score.ci_halfwidth
+
+    def _update_score_stats(self, score):
+        delta = score - self.score_mean
+        self.score_mean += delta / self.samples
+        self.score_m2 += delta * (score - self.score_mean)
+
+    def ci_halfwidth(self):
+        """
+        :return: 采样得分均值的置信区间半宽，采样不足两个时为inf
+        """
+        if self.samples < 2:
+            return math.inf
+        variance = self.score_m2 / (self.samples - 1)
+        return self.px4_score.ci_z * math.sqrt(variance / self.samples)
+
+    def check_timeout(self, now):
+        """
+        检查是否超过msg_timeout没有得到对齐的采样，超时则该实例得0分。
+
+        :param now: 当前时间
+        :return: 窗口是否已结束
+        """
+        if not self.done and now - self.last_time >= self.msg_timeout:
+            self.timed_out = True
+            self.done = True
+        return self.done
+
+    def result(self, total_score):
+        """
+        :param total_score: 评分核心算出的该行总分
+        :return: 该实例的得分，超时为0
+        """
+        return 0 if self.timed_out else float(total_score)
+
+
+class PX4MissionWindow(PX4ScoreWindow):
+    """
+    整个任务的流式评分窗口。
+
+    从开始评分一直累加到最后一个航点的 MISSION_ITEM_REACHED，只保存累加和，内存占用固定。
+    除总分外，按当前目标航点（MISSION_CURRENT）把误差分到各航段，给出每个航段的得分。
+    """
+
+    def __init__(self, px4_score, score_array, row, mission_count, msg_timeout=0.5):
+        super().__init__(px4_score, score_array, row, msg_timeout)
+        self.last_seq = mission_count - 1
+        # 当前目标航点，即当前航段
+        self.segment = 0
+        self.reached = -1
+        # 每个航段的差值累加和与采样数
+        self.segment_sums = np.zeros((mission_count, len(SCORE_FIELDS)))
+        self.segment_counts = np.zeros(mission_count, dtype=np.int64)
+
+    def feed(self, msg):
+        if self.done:
+            return True
+        msg_type = msg.get_type()
+        if msg_type == "MISSION_CURRENT":
+            self.segment = min(msg.seq, self.last_seq)
+            return False
+        if msg_type == "MISSION_ITEM_REACHED":
+            self.reached = max(self.reached, msg.seq)
+            self.segment = min(msg.seq + 1, self.last_seq)
+            self.done = self._mission_finished()
+            return self.done
+        return super().feed(msg)
+
+    def _on_sample(self):
+        super()._on_sample()
+        row = self.row
+        self.segment_sums[self.segment] += np.abs(self.score_array.state[row] - self.score_array.setpoint[row])
+        self.segment_counts[self.segment] += 1
+
+    def _mission_finished(self):
+        # 到达最后一个航点，任务结束；采样不足 min_samples 时在之后的采样中补足再结束
+        return self.reached >= self.last_seq and self.samples >= self.px4_score.min_samples
+
+    def _window_done(self):
+        # 任务没有按时结束时，以 max_mission_ms 为上限
+        return self._mission_finished() or self.sim_elapsed_ms >= self.px4_score.max_mission_ms
+
+    def segment_scores(self):
+        """
+        :return: 每个航段的得分列表，没有采样的航段为nan
+        """
+        segment_array = self.px4_score._new_score_array(len(self.segment_counts))
+        segment_array.diff_sum[:] = self.segment_sums
+        segment_array.count[:] = self.segment_counts
+        return segment_array.scores().tolist()
 
 
 class PX4Score:
-    def __init__(self, instance_count, sim_speed, base_port):
+    def __init__(self, instance_count, sim_speed, base_port, loop_count=1, trigger_type="LOCAL_POSITION_NED", max_skew_ms=20,
+                 link_pool=None, window_ms=1000, min_samples=10, ci_halfwidth=None, ci_z=1.96, mode="window",
+                 mission_count=None, max_mission_ms=900000):
         """
         初始化PX4Score类。
 
         :param instance_count: PX4实例的数量
         :param sim_speed: 仿真速度
         :param base_port: 基础端口号
+        :param loop_count: 事件循环的个数，大于1时每个事件循环在单独的进程中运行
+        :param trigger_type: 到达时生成一个采样的消息类型，须为SAMPLE_TYPES之一
+        :param max_skew_ms: 同一采样中各消息 time_boot_ms 的最大允许差值（毫秒）
+        :param link_pool: 共享的PX4LinkPool，为None时自行绑定端口
+        :param window_ms: 评分窗口的仿真时间长度（毫秒）
+        :param min_samples: 窗口结束前至少需要的对齐采样数
+        :param ci_halfwidth: 得分置信区间半宽的提前结束阈值，None表示不提前结束
+        :param ci_z: 置信区间的z值，1.96对应95%
+        :param mode: window（固定长度窗口）或 mission（整个任务，到最后一个航点为止）
+        :param mission_count: mission模式下任务的航点数量，各实例任务不同时为函数 mission_count(实例编号)
+        :param max_mission_ms: mission模式下评分的最长仿真时间（毫秒）
         """
         self.instance_count = instance_count
         self.sim_speed = sim_speed
         self.base_port = base_port
+        self.loop_count = loop_count
+        self.trigger_type = trigger_type
+        self.max_skew_ms = max_skew_ms
+        self.link_pool = link_pool
+        self.window_ms = window_ms
+        self.min_samples = min_samples
+        self.ci_halfwidth = ci_halfwidth
+        self.ci_z = ci_z
+        self.mode = mode
+        self.mission_count = mission_count
+        self.max_mission_ms = max_mission_ms
+        if mode == "mission" and not mission_count:
+            raise ValueError("mission模式需要指定mission_count")
+        # 需要接收的消息类型
+        self.msg_types = SAMPLE_TYPES + MISSION_TYPES if mode == "mission" else SAMPLE_TYPES
+        # mission模式下最近一次评分的航段得分 {实例编号: [航段得分]}
+        self.segment_scores = {}
+        # 事件循环中检查消息超时的间隔（秒）
+        self.poll_interval = 0.01
+
+        # 定义每个维度差值的范围和权重
+        self.min_values = {
+            "position": {"x": 0.0, "y": 0.0, "z": 0.0},
+            "velocity": {"vx": 0.0, "vy": 0.0, "vz": 0.0},
+            "attitude": {"roll": 0.0, "pitch": 0.0, "yaw": 0.0},
+            "angular_velocity": {"rollspeed": 0.0, "pitchspeed": 0.0, "yawspeed": 0.0},
+        }
+
+        self.max_values = {
+            "position": {"x": 9.18, "y": 9.18, "z": 3.49},
+            "velocity": {"vx": 4.62, "vy": 4.62, "vz": 4.21},
+            "attitude": {
+                "roll": 2.03 * (math.pi / 180),
+                "pitch": 4.31 * (math.pi / 180),
+                "yaw": 6.23 * (math.pi / 180),
+            },
+            "angular_velocity": {
+                "rollspeed": 3.65 * (math.pi / 180),
+                "pitchspeed": 15.41 * (math.pi / 180),
+                "yawspeed": 14.32 * (math.pi / 180),
+            },
+        }
+
+        self.weights = {
+            "position": {"x": 1.0, "y": 1.0, "z": 1.0},
+            "velocity": {"vx": 1.0, "vy": 1.0, "vz": 1.0},
+            "attitude": {"roll": 1.0, "pitch": 1.0, "yaw": 1.0},
+            "angular_velocity": {"rollspeed": 1.0, "pitchspeed": 1.0, "yawspeed": 1.0},
+        }
         # self.masters = [
         #     mavutil.mavlink_connection(f"udp:127.0.0.1:{self.base_port + instance}")
         #     for instance in range(instance_count)
@@ -35,17 +288,88 @@ class PX4Score:
         :return: 返回所有实例的得分列表
         """
         instances = list(range(self.instance_count))
-        scores = list(range(self.instance_count))
+        # 有共享链路时在链路的事件循环中评分
+        if self.link_pool is not None:
+            return self.link_pool.run(self.count_score_async(instances))
+        if self.loop_count <= 1:
+            return self._count_scores_in_loop(instances)
 
-        # 并行执行计算得分函数
-        with multiprocessing.Pool() as pool:
-            scores = pool.map(self._count_single_score, instances)
-            # pool.join()   # 等待所有任务完成
+        # 按实例编号把实例分给多个事件循环，每个事件循环一个进程
+        slices = [instances[k::self.loop_count] for k in range(self.loop_count)]
+        with multiprocessing.Pool(self.loop_count) as pool:
+            results = pool.map(self._count_scores_in_loop, slices)
 
-        # print(scores)
-        
+        scores = list(range(self.instance_count))
+        for part, part_scores in zip(slices, results):
+            for instance, score in zip(part, part_scores):
+                scores[instance] = score
         return scores
 
+    def _count_scores_in_loop(self, instances):
+        """
+        在一个事件循环中计算一组PX4实例的得分。
+
+        :param instances: PX4实例编号列表
+        :return: 与instances顺序一致的得分列表
+        """
+        return asyncio.run(self.count_score_async(instances))
+
+    async def count_score_async(self, instances):
+        """
+        绑定所有实例的端口，消息到达后分发给各自的评分窗口，直到全部窗口结束。
+
+        :param instances: PX4实例编号列表
+        :return: 与instances顺序一致的得分列表
+        """
+        score_array = self._new_score_array(len(instances))
+        windows = {instance: self._new_window(score_array, row, instance) for row, instance in enumerate(instances)}
+
+        if self.link_pool is None:
+            async with PX4MavMux(instances, self.base_port, msg_types=self.msg_types) as mux:
+                await self._run_windows(mux, windows)
+        else:
+            await self.link_pool.open(instances)
+            self.link_pool.mux.watch(self.msg_types)
+            await self._run_windows(self.link_pool.mux, windows)
+
+        # 所有窗口结束后一次性计算全部实例的得分
+        total_scores = score_array.scores()
+        if self.mode == "mission":
+            self.segment_scores = {instance: window.segment_scores() for instance, window in windows.items()}
+        return [windows[instance].result(total_scores[row]) for row, instance in enumerate(instances)]
+
+    async def _run_windows(self, mux, windows):
+        """
+        把复用器收到的消息分发给各实例的评分窗口，直到全部窗口结束。
+
+        :param mux: PX4MavMux对象
+        :param windows: {实例编号: PX4ScoreWindow}
+        """
+        def on_message(link, msg):
+            window = windows.get(link.instance_num)
+            if window is not None:
+                window.feed(msg)
+
+        # 只登记到本次评分的实例上，其他实例的消息不经过本处理函数
+        mux.add_handler(on_message, list(windows))
+        try:
+            pending = list(windows.values())
+            while pending:
+                await asyncio.sleep(self.poll_interval)
+                now = time.time()
+                pending = [window for window in pending if not window.check_timeout(now)]
+        finally:
+            mux.remove_handler(on_message, list(windows))
+
+    def _new_score_array(self, instance_count):
+        return PX4ScoreArray(instance_count, self.min_values, self.max_values, self.weights)
+
+    def _new_window(self, score_array, row, instance=None):
+        if self.mode == "mission":
+            mission_count = self.mission_count(instance) if callable(self.mission_count) else self.mission_count
+            return PX4MissionWindow(self, score_array, row, mission_count)
+        return PX4ScoreWindow(self, score_array, row)
+
     def _count_single_score(self, instance):
         """
         计算单个PX4实例的适应度得分。
@@ -54,7 +378,10 @@ class PX4Score:
         :return: 返回该实例的得分
         """
         master = mavutil.mavlink_connection(f"udp:127.0.0.1:{self.base_port + instance}")
-        return self._monitor_px4_state(master)
+        try:
+            return self._monitor_px4_state(master, instance)
+        finally:
+            master.close()
 
     def _get_current_state(self, pos_msg, att_msg):
         """
@@ -171,130 +498,34 @@ class PX4Score:
 
         return total_score / total_weight
 
-    def _monitor_px4_state(self, master):
+    def _monitor_px4_state(self, master, instance=None):
         """
         监听PX4消息流，计算每一秒内差值的平均值，并输出分数。
 
         :param master: MAVLink连接对象
+        :param instance: PX4实例的编号
         :return: 返回总分
         """
-        # 初始化差值累加器
-        total_difference = {
-            "position": {"x": 0.0, "y": 0.0, "z": 0.0},
-            "velocity": {"vx": 0.0, "vy": 0.0, "vz": 0.0},
-            "attitude": {"roll": 0.0, "pitch": 0.0, "yaw": 0.0},
-            "angular_velocity": {"rollspeed": 0.0, "pitchspeed": 0.0, "yawspeed": 0.0},
-        }
-
-        # 初始化计数器
-        count = 0
-
-        # 开始时间
-        start_time = time.time()
-
-        # 定义每个维度差值的范围和权重
-        min_values = {
-            "position": {"x": 0.0, "y": 0.0, "z": 0.0},
-            "velocity": {"vx": 0.0, "vy": 0.0, "vz": 0.0},
-            "attitude": {"roll": 0.0, "pitch": 0.0, "yaw": 0.0},
-            "angular_velocity": {"rollspeed": 0.0, "pitchspeed": 0.0, "yawspeed": 0.0},
-        }
-
-        max_values = {
-            "position": {"x": 9.18, "y": 9.18, "z": 3.49},
-            "velocity": {"vx": 4.62, "vy": 4.62, "vz": 4.21},
-            "attitude": {
-                "roll": 2.03 * (math.pi / 180),
-                "pitch": 4.31 * (math.pi / 180),
-                "yaw": 6.23 * (math.pi / 180),
-            },
-            "angular_velocity": {
-                "rollspeed": 3.65 * (math.pi / 180),
-                "pitchspeed": 15.41 * (math.pi / 180),
-                "yawspeed": 14.32 * (math.pi / 180),
-            },
-        }
-
-        weights = {
-            "position": {"x": 1.0, "y": 1.0, "z": 1.0},
-            "velocity": {"vx": 1.0, "vy": 1.0, "vz": 1.0},
-            "attitude": {"roll": 1.0, "pitch": 1.0, "yaw": 1.0},
-            "angular_velocity": {"rollspeed": 1.0, "pitchspeed": 1.0, "yawspeed": 1.0},
-        }
+        score_array = self._new_score_array(1)
+        window = self._new_window(score_array, 0, instance)
 
         while True:
             # 获取消息
-            msg_timeout = 0.5
-            att_msg = master.recv_match(type="ATTITUDE", blocking=True, timeout=msg_timeout)
-            att_target_msg = master.recv_match(type="ATTITUDE_TARGET", blocking=True, timeout=msg_timeout)
-            pos_target_msg = master.recv_match(type="POSITION_TARGET_LOCAL_NED", blocking=True, timeout=msg_timeout)
-            pos_msg = master.recv_match(type="LOCAL_POSITION_NED", blocking=True, timeout=msg_timeout)
-            
-            if any(msg is None for msg in [att_msg, att_target_msg, pos_target_msg, pos_msg]):
+            msg = master.recv_match(type=self.msg_types, blocking=True, timeout=window.msg_timeout)
+
+            if msg is None or window.check_timeout(time.time()):
                 # print("接收到无效的消息，程序终止")
                 return 0 # 如果你想终止程序，可以使用return
 
-            
-            # 计算当前状态和设定值
-            current_state = self._get_current_state(pos_msg, att_msg)
-            setpoint = self._get_setpoints(pos_target_msg, att_target_msg)
-
-            # 计算差值
-            difference = self._calculate_difference(current_state, setpoint)
-
-            # 累加差值
-            for key in total_difference:
-                for subkey in total_difference[key]:
-                    total_difference[key][subkey] += difference[key][subkey]
-
-            # 增加计数器
-            count += 1
-
-            # 如果达到1秒，计算平均值并输出
-            if time.time() - start_time >= 1.0/self.sim_speed:
-                if count > 0:
-                    # 计算平均值
-                    average_difference = {
-                        "position": {
-                            "x": total_difference["position"]["x"] / count,
-                            "y": total_difference["position"]["y"] / count,
-                            "z": total_difference["position"]["z"] / count,
-                        },
-                        "velocity": {
-                            "vx": total_difference["velocity"]["vx"] / count,
-                            "vy": total_difference["velocity"]["vy"] / count,
-                            "vz": total_difference["velocity"]["vz"] / count,
-                        },
-                        "attitude": {
-                            "roll": total_difference["attitude"]["roll"] / count,
-                            "pitch": total_difference["attitude"]["pitch"] / count,
-                            "yaw": total_difference["attitude"]["yaw"] / count,
-                        },
-                        "angular_velocity": {
-                            "rollspeed": total_difference["angular_velocity"]["rollspeed"] / count,
-                            "pitchspeed": total_difference["angular_velocity"]["pitchspeed"] / count,
-                            "yawspeed": total_difference["angular_velocity"]["yawspeed"] / count,
-                        },
-                    }
-
-                    # 计算总分
-                    total_score = self._calculate_total_score(average_difference, min_values, max_values, weights)
-
-                # 重置累加器和计数器
-                total_difference = {
-                    "position": {"x": 0.0, "y": 0.0, "z": 0.0},
-                    "velocity": {"vx": 0.0, "vy": 0.0, "vz": 0.0},
-                    "attitude": {"roll": 0.0, "pitch": 0.0, "yaw": 0.0},
-                    "angular_velocity": {"rollspeed": 0.0, "pitchspeed": 0.0, "yawspeed": 0.0},
-                }
-                count = 0
-                start_time = time.time()
-                break
-
-        return total_score
+            if window.feed(msg):
+                return window.result(score_array.scores()[0])
 
 
 if __name__ == "__main__":
+    # 读取配置文件
+    with open("config.yaml", "r") as f:
+        config = yaml.load(f.read(), Loader=yaml.FullLoader)
+
     # 创建 ArgumentParser 对象
     parser = argparse.ArgumentParser()
 
@@ -305,12 +536,10 @@ if __name__ == "__main__":
     # 解析参数
     args = parser.parse_args()
 
-    px4Score = PX4Score(args.instance_count, args.sim_speed, config["simulation"]["connect_port_2"])
+    px4Score = PX4Score(args.instance_count, args.sim_speed, config["simulation"]["connect_port_2"], **config.get("score", {}))
 
     count =0
     
-    import numpy as np
-    
     while True:
         count+=1
 
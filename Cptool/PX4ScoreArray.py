@@ -0,0 +1,204 @@
+import math
+import random
+
+import numpy as np
+
+
+# 12个评分维度的固定顺序，与PX4Score中各字典的遍历顺序一致
+SCORE_FIELDS = [
+    ("position", "x"), ("position", "y"), ("position", "z"),
+    ("velocity", "vx"), ("velocity", "vy"), ("velocity", "vz"),
+    ("attitude", "roll"), ("attitude", "pitch"), ("attitude", "yaw"),
+    ("angular_velocity", "rollspeed"), ("angular_velocity", "pitchspeed"), ("angular_velocity", "yawspeed"),
+]
+
+
+def fields_to_array(values):
+    """
+    将 {维度: {子维度: 值}} 形式的字典按SCORE_FIELDS顺序转换为一维数组。
+
+    :param values: 嵌套字典，例如PX4Score.max_values
+    :return: 长度为12的float数组
+    """
+    return np.array([values[key][subkey] for key, subkey in SCORE_FIELDS], dtype=np.float64)
+
+
+class PX4ScoreArray:
+    """
+    向量化的12维误差评分核心。
+
+    所有实例的状态、设定值和差值累加器保存为 (实例数 × 12) 的数组，
+    归一化和加权平均对全部实例一次完成。计算顺序与PX4Score中基于字典的实现逐项一致，
+    因此得分完全相同。
+    """
+
+    def __init__(self, instance_count, min_values, max_values, weights):
+        """
+        :param instance_count: 实例（行）的数量
+        :param min_values: 每个维度差值的最小值（嵌套字典）
+        :param max_values: 每个维度差值的最大值（嵌套字典）
+        :param weights: 每个维度的权重（嵌套字典）
+        """
+        self.instance_count = instance_count
+        self.min_values = fields_to_array(min_values)
+        self.max_values = fields_to_array(max_values)
+        self.weights = fields_to_array(weights)
+        # 与字典实现相同的求和方式，保证总权重逐位一致
+        self.total_weight = sum(weights[key][subkey] for key, subkey in SCORE_FIELDS)
+
+        self.state = np.zeros((instance_count, len(SCORE_FIELDS)))
+        self.setpoint = np.zeros((instance_count, len(SCORE_FIELDS)))
+        self.diff_sum = np.zeros((instance_count, len(SCORE_FIELDS)))
+        self.count = np.zeros(instance_count, dtype=np.int64)
+
+    def set_state(self, row, pos_msg, att_msg):
+        """
+        从 LOCAL_POSITION_NED 和 ATTITUDE 消息写入当前状态。
+
+        :param row: 实例所在的行
+        :param pos_msg: LOCAL_POSITION_NED 消息
+        :param att_msg: ATTITUDE 消息
+        """
+        self.state[row] = (
+            pos_msg.x, pos_msg.y, pos_msg.z,
+            pos_msg.vx, pos_msg.vy, pos_msg.vz,
+            att_msg.roll, att_msg.pitch, att_msg.yaw,
+            att_msg.rollspeed, att_msg.pitchspeed, att_msg.yawspeed,
+        )
+
+    def set_setpoint(self, row, pos_target_msg, att_target_msg):
+        """
+        从 POSITION_TARGET_LOCAL_NED 和 ATTITUDE_TARGET 消息写入设定值。
+
+        :param row: 实例所在的行
+        :param pos_target_msg: POSITION_TARGET_LOCAL_NED 消息
+        :param att_target_msg: ATTITUDE_TARGET 消息
+        """
+        # 将四元数转换为欧拉角（roll, pitch），与PX4Score._get_setpoints相同
+        q_w, q_x, q_y, q_z = att_target_msg.q[0], att_target_msg.q[1], att_target_msg.q[2], att_target_msg.q[3]
+        roll = math.atan2(2 * (q_w * q_x + q_y * q_z), 1 - 2 * (q_x**2 + q_y**2))
+        pitch = math.asin(2 * (q_w * q_y - q_z * q_x))
+
+        self.setpoint[row] = (
+            pos_target_msg.x, pos_target_msg.y, pos_target_msg.z,
+            pos_target_msg.vx, pos_target_msg.vy, pos_target_msg.vz,
+            roll, pitch, pos_target_msg.yaw,
+            att_target_msg.body_roll_rate, att_target_msg.body_pitch_rate, att_target_msg.body_yaw_rate,
+        )
+
+    def accumulate(self, rows):
+        """
+        累加指定行当前状态与设定值的绝对误差。rows可以包含重复行，按顺序逐次累加。
+
+        :param rows: 行号或行号数组
+        """
+        rows = np.atleast_1d(rows)
+        np.add.at(self.diff_sum, rows, np.abs(self.state[rows] - self.setpoint[rows]))
+        np.add.at(self.count, rows, 1)
+
+    def sample_scores(self, rows):
+        """
+        只用当前一次采样（当前状态与设定值）计算指定行的得分，不改变累加器。
+        下限均为0时归一化是线性的，总分等于各次采样得分的平均值，可用于估计置信区间。
+
+        :param rows: 行号或行号数组
+        :return: 得分数组
+        """
+        rows = np.atleast_1d(rows)
+        difference = np.abs(self.state[rows] - self.setpoint[rows])
+        normalized = 100 * (difference - self.min_values) / (self.max_values - self.min_values)
+        normalized = np.where(difference < self.min_values, 0.0, normalized)
+        return normalized @ self.weights / self.total_weight
+
+    def reset(self, rows=None):
+        """
+        清空指定行（默认全部）的累加器。
+
+        :param rows: 行号数组，None表示全部
+        """
+        if rows is None:
+            rows = slice(None)
+        self.diff_sum[rows] = 0.0
+        self.count[rows] = 0
+
+    def scores(self, rows=None):
+        """
+        计算指定行（默认全部）的总分（0-100）。
+
+        :param rows: 行号数组，None表示全部
+        :return: 得分数组，没有样本的行为nan
+        """
+        if rows is None:
+            rows = slice(None)
+        count = self.count[rows]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            average = self.diff_sum[rows] / count[:, None]
+            normalized = 100 * (average - self.min_values) / (self.max_values - self.min_values)
+        normalized = np.where(average < self.min_values, 0.0, normalized)
+
+        # 按维度顺序逐列加权求和，与字典实现的累加顺序一致
+        total = np.zeros(len(count))
+        for column in range(len(SCORE_FIELDS)):
+            total += normalized[:, column] * self.weights[column]
+        return total / self.total_weight
+
+
+def check_against_dict_score(instance_count=64, samples=50, seed=0):
+    """
+    用随机消息比较向量化实现与PX4Score中基于字典的实现，二者得分必须逐位相同。
+
+    :param instance_count: 实例数量
+    :param samples: 每个实例的样本数量
+    :param seed: 随机种子
+    :return: 两种实现的得分列表
+    """
+    from pymavlink.dialects.v20 import common as mavlink
+    from PX4Score import PX4Score
+
+    px4Score = PX4Score(instance_count, 1, 0)
+    scoreArray = PX4ScoreArray(instance_count, px4Score.min_values, px4Score.max_values, px4Score.weights)
+    rnd = random.Random(seed)
+
+    dict_scores = []
+    for row in range(instance_count):
+        total_difference = {key: {subkey: 0.0 for subkey in values} for key, values in px4Score.min_values.items()}
+        for _ in range(samples):
+            # 误差范围覆盖归一化上限，保证有超过100分的维度
+            att_msg = mavlink.MAVLink_attitude_message(0, *[rnd.uniform(-0.3, 0.3) for _ in range(6)])
+            pos_msg = mavlink.MAVLink_local_position_ned_message(0, *[rnd.uniform(-10, 10) for _ in range(6)])
+            q = [rnd.uniform(-1, 1) for _ in range(4)]
+            norm = math.sqrt(sum(v * v for v in q))
+            att_target_msg = mavlink.MAVLink_attitude_target_message(
+                0, 0, [v / norm for v in q], *[rnd.uniform(-0.3, 0.3) for _ in range(3)], 0.5
+            )
+            pos_target_msg = mavlink.MAVLink_position_target_local_ned_message(
+                0, 1, 0, *[rnd.uniform(-10, 10) for _ in range(6)], 0, 0, 0, rnd.uniform(-3, 3), 0
+            )
+
+            difference = px4Score._calculate_difference(
+                px4Score._get_current_state(pos_msg, att_msg), px4Score._get_setpoints(pos_target_msg, att_target_msg)
+            )
+            for key in total_difference:
+                for subkey in total_difference[key]:
+                    total_difference[key][subkey] += difference[key][subkey]
+
+            scoreArray.set_state(row, pos_msg, att_msg)
+            scoreArray.set_setpoint(row, pos_target_msg, att_target_msg)
+            scoreArray.accumulate(row)
+
+        average_difference = {
+            key: {subkey: value / samples for subkey, value in values.items()}
+            for key, values in total_difference.items()
+        }
+        dict_scores.append(
+            px4Score._calculate_total_score(average_difference, px4Score.min_values, px4Score.max_values, px4Score.weights)
+        )
+
+    array_scores = scoreArray.scores().tolist()
+    assert array_scores == dict_scores, "向量化得分与字典实现不一致"
+    return dict_scores, array_scores
+
+
+if __name__ == "__main__":
+    dict_scores, array_scores = check_against_dict_score()
+    print(f"{len(array_scores)}个实例的向量化得分与字典实现完全一致")
@@ -1,8 +1,13 @@
 import numpy as np
 import time
 import yaml
+from PX4Barrier import PX4Barrier, home_position_ready, mission_active
+from PX4LinkPool import PX4LinkPool
 from PX4Mission import PX4Mission
+from PX4MissionLibrary import PX4MissionLibrary
 from PX4Param import PX4Param
+from PX4Placement import PX4Placement
+from PX4ResultCache import PX4ResultCache, build_fingerprint
 from PX4Score import PX4Score   
 from PX4SihSim import PX4SihSim  
 
@@ -20,6 +25,17 @@ class PX4SihMain:
         self.is_daemon=config["simulation"]["daemon"]
         self.base_port = config["simulation"]["connect_port_2"]
         self.param_files = config["param_files"]["px4"]
+        # 任务、参数、评分三个阶段共用的MAVLink链路
+        self.link_pool = PX4LinkPool(self.base_port)
+        # px4实例与编排进程的CPU放置策略
+        self.placement = PX4Placement.from_config(config)
+        # 任务库，各实例的任务航点只生成一次
+        self.missionLibrary = PX4MissionLibrary.from_config(config)
+        # 评估结果缓存，未启用时为None
+        self.resultCache = None
+        cache_config = config.get("cache", {})
+        if cache_config.get("enabled", False):
+            self.resultCache = PX4ResultCache.from_config(config, self.param_files)
         
     # def __init__(self, px4_working_dir, px4_build_dir, sim_speed, instance_count, is_daemon):
     #     # 初始化类属性
@@ -29,39 +45,100 @@ class PX4SihMain:
     #     self.instance_count = instance_count
     #     self.is_daemon = is_daemon
         
+    def _cache_context(self, instance_num):
+        """除参数外影响得分的条件：实例的任务、仿真速度、px4编译版本和评分配置"""
+        plan = self.missionLibrary.for_instance(instance_num)
+        return {
+            "mission": [plan.name, plan.waypoints, plan.accept_radius],
+            "sim_speed": self.sim_speed,
+            "build": build_fingerprint(self.px4_build_dir),
+            "score": config.get("score", {}),
+        }
+
     def TestParam(self,param_group):
+        """
+        评估一组参数，已在结果缓存中的参数直接作答，只飞行缺少的部分。
+
+        :param param_group: 参数值列表的列表，第i组在第i个实例上评估
+        :return: 与param_group顺序一致的得分列表，失败为nan
+        """
+        if self.resultCache is None:
+            return self._test_param_group(param_group)
+
+        keys = [self.resultCache.key(param_values, self._cache_context(i)) for i, param_values in enumerate(param_group)]
+        flights = self.resultCache.missing(keys)
+        if flights:
+            # 需要飞行的参数组依次放到前几个实例上，任务保持与原位置相同
+            saved_assignment = dict(self.missionLibrary.assignment)
+            plans = [self.missionLibrary.for_instance(i).name for i in flights]
+            try:
+                for instance_num, name in enumerate(plans):
+                    self.missionLibrary.assign([instance_num], name)
+                scores = self._test_param_group([param_group[i] for i in flights])
+            finally:
+                self.missionLibrary.assignment = saved_assignment
+            for i, score in zip(flights, scores):
+                self.resultCache.put(keys[i], score, param_group[i])
+            self.resultCache.commit()
+        self.resultCache.record(len(param_group), len(flights))
+        return self.resultCache.scores(keys)
+
+    def _test_param_group(self,param_group):
         # 实例个数
         instance_count = len(param_group)
+        instances = list(range(instance_count))
         
         # 启动多个实例的并行处理
         print(f"启动{instance_count}个实例...")
-        px4SihSim = PX4SihSim(self.px4_working_dir,self.px4_build_dir,self.sim_speed,instance_count,self.is_daemon)
-        # px4SihSim.start_sih_sitl()
-        px4SihSim.start_sih_sitl_bash()
-        time.sleep(15)
+        # 编排进程（含链路线程）固定在预留CPU上，px4实例分布在其余CPU上
+        self.placement.pin_orchestrator()
+        px4SihSim = PX4SihSim(self.px4_working_dir,self.px4_build_dir,self.sim_speed,instance_count,self.is_daemon,
+                              launcher_config=config.get("launcher"),placement=self.placement)
+        # px4SihSim.start_sih_sitl_bash()
+        px4SihSim.start_sih_sitl()
+        # 实例重新启动，链路需要重新等待心跳
+        self.link_pool.mark_restarted(instances)
+        # 等待心跳和home位置有效
+        ready = PX4Barrier.from_config("launch", config).wait_links(self.link_pool, instances, home_position_ready)
         print(f"完成...")
         
         
         
         print("开始设定执行任务...")
-        px4Mission = PX4Mission(instance_count,self.base_port)
-        px4Mission.start_multiple_mission()
-        time.sleep(15)
+        px4Mission = PX4Mission(instance_count,self.base_port,self.link_pool,library=self.missionLibrary,
+                                **config.get("mission", {}))
+        accepted = dict(zip(ready, px4Mission.start_multiple_mission(ready)))
+        # 等待任务被接受、进入MISSION模式并爬升到指定高度
+        min_altitude = config["barriers"]["mission"]["min_altitude"]
+
+        async def mission_ready(link):
+            return accepted[link.instance_num] and await mission_active(link, min_altitude)
+
+        ready = PX4Barrier.from_config("mission", config).wait_links(self.link_pool, ready, mission_ready)
         print(f"完成...")
         
         
         
         print("开始修改多个实例的参数...")
-        px4_param = PX4Param(instance_count,self.base_port,self.param_files)
-        px4_param.change_multiple_params(param_group)
-        time.sleep(5)
+        px4_param = PX4Param(instance_count,self.base_port,self.param_files,self.link_pool)
+        reports = dict(zip(ready, px4_param.change_multiple_params([param_group[i] for i in ready], ready)))
+
+        # 参数回显全部确认即就绪
+        async def param_ready(link):
+            return None not in reports[link.instance_num].values()
+
+        ready = PX4Barrier.from_config("param", config).wait_links(self.link_pool, ready, param_ready)
         print(f"完成...")
         
         
         
         print("开始计算多个实例的得分...")
-        px4Score = PX4Score(instance_count, self.sim_speed, self.base_port)
+        px4Score = PX4Score(instance_count, self.sim_speed, self.base_port, link_pool=self.link_pool,
+                            mission_count=px4Mission.library.mission_count, **config.get("score", {}))
         scores = px4Score.count_score()
+        # 未通过屏障的实例记为测试失败
+        ready = set(ready)
+        scores = [score if instance in ready else float("nan") for instance, score in enumerate(scores)]
         print(f"完成...")
         
         # 回收所有px4子进程
@@ -20,7 +20,7 @@ is_daemon=$5
 # 清理旧目录和进程
 # echo "清理工作目录和现有px4进程..."
 rm -rf "${px4_working_dir}"
-mkdir -p "${px4_working_dir}/instance"
+mkdir -p "${px4_working_dir}/instance_dir"
 mkdir -p "${px4_working_dir}/log"
 killall px4 2>/dev/null
 
@@ -30,7 +30,7 @@ declare -a pids=()
 # 定义启动单个实例的函数
 start_single_sih_sitl() {
     local instance_num=$1
-    local working_dir="${px4_working_dir}/instance/instance_${instance_num}"
+    local working_dir="${px4_working_dir}/instance_dir/instance_${instance_num}"
     # local working_dir="${px4_working_dir}/instance_${instance_num}"
     mkdir -p "$working_dir"
 
@@ -122,7 +122,7 @@ start_single_sih_sitl() {
 
 check_single_sih_sitl() {
     local instance_num=$1
-    local working_dir="${px4_working_dir}/instance/instance_${instance_num}"
+    local working_dir="${px4_working_dir}/instance_dir/instance_${instance_num}"
 
     local cmd=(
         "${px4_build_dir}/bin/px4-commander"
@@ -161,6 +161,8 @@ done
 # echo "检查完成"
 
 echo ${pids[*]}
+# 同时写入文件，供启动方登记PID
+echo ${pids[*]} > "${px4_working_dir}/pids"
 
 
 # # 清理函数
@@ -2,15 +2,17 @@ import time
 import argparse
 import os
 import subprocess
-import multiprocessing
 
 import yaml
 
+from PX4Registry import PX4Registry
+from PX4ResultCache import build_fingerprint
+from PX4Workdirs import PX4Workdirs
 
 
 class PX4SihSim:
 
-    def __init__(self, px4_working_dir, px4_build_dir, sim_speed, instance_count, is_daemon):
+    def __init__(self, px4_working_dir, px4_build_dir, sim_speed, instance_count, is_daemon, registry=None, launcher_config=None, placement=None):
         # 初始化类属性
         self.px4_working_dir = px4_working_dir
         self.px4_build_dir = px4_build_dir
@@ -19,13 +21,47 @@ class PX4SihSim:
         self.is_daemon = is_daemon
         # 初始化用于存储模拟实例进程的列表
         self.processes = []
+        # 实例编号 → PID/端口/工作目录的登记表
+        self.registry = registry if registry is not None else PX4Registry()
+        # 启动速率、批大小、nice值和CPU集合，见config.yaml的launcher配置
+        launcher_config = launcher_config or {}
+        self.spawn_rate = launcher_config.get("spawn_rate", 0)
+        self.batch_size = launcher_config.get("batch_size", 50)
+        self.nice = launcher_config.get("nice", 0)
+        self.cpus = launcher_config.get("cpus") or None
+        # 等待第一个实例写出默认参数和dataman以生成模板的超时时间（秒）
+        self.seed_timeout = launcher_config.get("seed_timeout", 10)
+        # 由共享模板生成实例工作目录，px4重新编译后模板失效
+        self.workdirs = PX4Workdirs(px4_working_dir, build_id=build_fingerprint(px4_build_dir))
+        # 按实例编号分配CPU的放置策略（PX4Placement），只在launcher配置的cpus范围内分配
+        self.placement = placement
+
+    def _affinity_prefix(self, cpus, nice):
+        """
+        生成设置CPU亲和性和nice值的命令前缀（taskset、nice），两者都直接exec下一个命令，
+        PID不变，px4在启动线程之前就已继承这些设置。
+        不使用preexec_fn：它在fork与exec之间运行Python代码，父进程有其他线程（如PX4LinkPool）时可能死锁。
+        """
+        prefix = []
+        if cpus:
+            prefix += ["taskset", "-c", ",".join(str(cpu) for cpu in sorted(cpus))]
+        if nice:
+            prefix += ["nice", "-n", str(nice)]
+        return prefix
+
     # 开启一个硬件内仿真(sih)进程，返回进程PID
-    def start_single_sih_sitl(self, instance_num):
+    # command_prefix 用于在px4命令前加上包装命令，例如在独立的PID命名空间中启动
+    # cpus/nice 为px4进程的CPU亲和性和nice值，默认使用launcher配置
+    def start_single_sih_sitl(self, instance_num, command_prefix=None, cpus=None, nice=None):
         # 设定px4进程的工作目录
         px4_working_dir = f"{self.px4_working_dir}/instance_dir/instance_{instance_num}"
         # px4_working_dir = f"{self.px4_working_dir}/instance/instance_{instance_num}"
         # os.system(f"rm -rf {px4_working_dir} && mkdir -p {px4_working_dir}")
-        os.system(f"mkdir -p {px4_working_dir}")
+        if not os.path.isdir(px4_working_dir):
+            self.workdirs.provision([instance_num])
+        if cpus is None and self.placement is not None:
+            cpus = self.placement.cpus_for(instance_num)
+        command_prefix = self._affinity_prefix(cpus or self.cpus, self.nice if nice is None else nice) + (command_prefix or [])
 
 
         px4_env = os.environ.copy()
@@ -52,8 +88,10 @@ class PX4SihSim:
             # stdout_file = open(f"{self.px4_working_dir}/log/{instance_num}.log", "w")
 
             process = subprocess.Popen(
-                start_px4_sih_sitl_command, env=px4_env, stdout=stdout_file, stderr=stdout_file  # 重定向stdout到文件  # 重定向stderr到文件
+                command_prefix + start_px4_sih_sitl_command, env=px4_env, stdout=stdout_file, stderr=stdout_file  # 重定向stdout到文件  # 重定向stderr到文件
             )
+            # 子进程已持有文件，父进程关闭自己的副本，避免上千个实例耗尽文件描述符
+            stdout_file.close()
         elif self.is_daemon == "False":
             # px4 sih仿真启动命令
             start_px4_sih_sitl_command = [
@@ -67,35 +105,70 @@ class PX4SihSim:
                 f"{self.px4_build_dir}/etc/init.d-posix/rcS",
             ]
             process = subprocess.Popen(
-                start_px4_sih_sitl_command, env=px4_env
+                command_prefix + start_px4_sih_sitl_command, env=px4_env
             )
             # print(f"instance_count:{instance_count} Process ID (PID):{process.pid}")
+        self.registry.register(instance_num, process.pid, px4_working_dir)
         return process.pid
 
-    # 并行执行多个Sih实例的启动
-    def start_sih_sitl(self):
-        instance_count = self.instance_count
-        
-        # 清理并准备工作目录
-        os.system(f"rm -rf {self.px4_working_dir}")
-        os.system(f"mkdir -p {self.px4_working_dir}/instance")
-        os.system(f"mkdir -p {self.px4_working_dir}/log")
-        # 清理所有系统中的 px4 进程
-        os.system("killall px4")
+    # 在本进程中分批、限速启动多个Sih实例
+    def start_sih_sitl(self, instances=None):
+        """
+        直接在本进程中启动实例，不经过bash脚本。每批启动batch_size个实例，
+        按spawn_rate（实例/秒）限速，避免上千个实例同时初始化抢占CPU，
+        导致先启动的实例错过时限。PID登记到登记表。
 
+        :param instances: PX4实例编号列表，默认启动全部instance_count个实例
+        :return: {实例编号: PID}
+        """
+        instances = list(range(self.instance_count)) if instances is None else list(instances)
 
-        # 使用 Process 来并行执行进程
-        for i in range(instance_count):  # 启动 instance_count 个实例
-            p = multiprocessing.Process(target=self.start_single_sih_sitl, args=(i,))
-            self.processes.append(p)
-            p.start()
-
-        # # 等待所有进程完成
-        # for p in self.processes:
-        #     p.join()
-        print(f"px4实例数量：{instance_count}")
+        # 清理所有系统中的 px4 进程
+        subprocess.run(["killall", "px4"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.registry.clear()
+        # 旧工作目录改名后在后台删除，再由模板生成实例目录
+        self.workdirs.cleanup()
+        os.makedirs(f"{self.px4_working_dir}/log", exist_ok=True)
+        if instances and not self.workdirs.template_ready():
+            # 先单独启动一个实例，用它写出的默认参数和dataman生成模板
+            self._seed_template(instances[0])
+            instances_to_start = instances[1:]
+        else:
+            instances_to_start = instances
+        provision_time = self.workdirs.provision(instances_to_start)
+        print(f"已生成{len(instances_to_start)}个实例工作目录，耗时 {provision_time * 1000:.1f} 毫秒")
+
+        start_time = time.perf_counter()
+        batch_size = self.batch_size or len(instances_to_start) or 1
+        for batch_start in range(0, len(instances_to_start), batch_size):
+            batch = instances_to_start[batch_start:batch_start + batch_size]
+            for instance_num in batch:
+                self.start_single_sih_sitl(instance_num)
+            if self.spawn_rate and batch_start + len(batch) < len(instances_to_start):
+                # 下一批的计划启动时间
+                next_time = start_time + (batch_start + len(batch)) / self.spawn_rate
+                time.sleep(max(0.0, next_time - time.perf_counter()))
+
+        print(f"px4实例数量：{len(instances)}，启动耗时 {time.perf_counter() - start_time:.2f} 秒")
         print("All Sih PX4 instances started.")
-        # return self.processes
+        return self.registry.pids(instances)
+
+    def _seed_template(self, instance_num):
+        """
+        由空模板启动一个实例，等待其写出默认参数和dataman后用它的工作目录生成模板，
+        实例继续运行。超时时保留空模板，下次启动时再试。
+        """
+        self.workdirs.provision([instance_num])
+        self.start_single_sih_sitl(instance_num)
+        deadline = time.perf_counter() + self.seed_timeout
+        while not self.workdirs.seed_ready(instance_num) and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        if self.workdirs.seed_ready(instance_num):
+            self.workdirs.build_template(self.workdirs.instance_dir(instance_num))
+            print(f"已由实例{instance_num}生成工作目录模板")
+        else:
+            print(f"实例{instance_num}未在{self.seed_timeout}秒内写出默认参数，继续使用空模板")
+
     # 并行执行多个Sih实例的启动
     def start_sih_sitl_bash(self):
         command = ["bash","./Cptool/PX4SihSim.bash",str(self.px4_working_dir), str(self.px4_build_dir), str(self.instance_count), str(self.sim_speed), str(self.is_daemon)]
@@ -114,12 +187,24 @@ class PX4SihSim:
         # print(stdout)
         
         process = subprocess.Popen(command)
-
+        # 脚本启动完所有实例后退出，并把各实例PID写入 pids 文件
+        process.wait()
+        self.registry.clear()
+        try:
+            with open(f"{self.px4_working_dir}/pids", "r") as f:
+                pids = [int(pid) for pid in f.read().split()]
+        except (OSError, ValueError):
+            print("未能读取实例PID")
+            return
+        for instance_num, pid in enumerate(pids):
+            # 与Python启动路径和CRIU恢复使用同一个实例目录
+            self.registry.register(instance_num, pid, self.workdirs.instance_dir(instance_num))
 
 
     # 回收所有px4子进程
     def stop_sih_sitl(self):
         os.system("killall px4")
+        self.registry.clear()
 
 
 if __name__ == "__main__":
@@ -147,9 +232,10 @@ if __name__ == "__main__":
         px4_build_dir=config['paths']['px4_build_dir'],
         sim_speed=args.sim_speed,
         instance_count=args.instance_count,
-        is_daemon=args.is_daemon
+        is_daemon=args.is_daemon,
+        launcher_config=config.get("launcher")
     )
-    px4SihSim.start_sih_sitl_bash()
+    px4SihSim.start_sih_sitl()
 
     # try:
     #     print("运行中，按 Ctrl+C 退出")
@@ -0,0 +1,163 @@
+import os
+import shutil
+import subprocess
+import time
+
+
+class PX4SnapshotStore:
+    """
+    基于硬链接的镜像和工作目录快照。
+
+    CRIU镜像文件（*.img）写入后不再修改（重新dump前会先删除镜像目录），
+    保存和恢复时只建立硬链接，不复制数据；px4工作目录中的其他文件可能被进程原地修改，
+    恢复时只复制大小或修改时间发生变化的文件，保存时未变化的文件直接链接上一份快照中的副本。
+
+    criu以root运行，写出的镜像、日志和恢复出的px4进程写入的文件属于root且权限为0600，
+    开启 fs.protected_hardlinks 时普通用户既不能链接也不能读取，因此每次保存和恢复前
+    先用 sudo chown 把相关目录交还给当前用户。
+    """
+
+    def __init__(self, immutable_suffixes=(".img",), take_ownership=True):
+        """
+        :param immutable_suffixes: 写入后不再修改、可以硬链接共享的文件后缀
+        :param take_ownership: 保存和恢复前是否把目录的所有者改为当前用户
+        """
+        self.immutable_suffixes = tuple(immutable_suffixes)
+        self.take_ownership = take_ownership
+
+    def _take_ownership(self, path):
+        """把root写入的文件交还给当前用户，没有sudo权限时忽略"""
+        if not self.take_ownership or not os.path.lexists(path):
+            return
+        try:
+            subprocess.run(
+                ["sudo", "-n", "chown", "-R", f"{os.getuid()}:{os.getgid()}", path],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            pass
+
+    def _is_immutable(self, path):
+        return path.endswith(self.immutable_suffixes)
+
+    def _link_or_copy(self, src, dst):
+        """硬链接不可变文件，跨文件系统或无权限时退回复制；其他文件直接复制"""
+        if self._is_immutable(src):
+            try:
+                os.link(src, dst)
+                return "linked"
+            except OSError:
+                pass
+        shutil.copy2(src, dst, follow_symlinks=False)
+        return "copied"
+
+    def _remove(self, path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+
+    def _same_file(self, src, dst):
+        """dst是否与src内容相同：硬链接比较inode，复制的文件比较大小和修改时间"""
+        try:
+            src_stat = os.lstat(src)
+            dst_stat = os.lstat(dst)
+        except OSError:
+            return False
+        if os.path.islink(src):
+            return os.path.islink(dst) and os.readlink(src) == os.readlink(dst)
+        if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+            return True
+        if self._is_immutable(src):
+            # 不可变文件应当是同一个inode，inode不同说明已被重新dump
+            return False
+        return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+    def _reuse(self, src, reuse, dst):
+        """src与上一份快照中的reuse相同时直接链接reuse，返回是否成功"""
+        if reuse is None or os.path.islink(src) or not self._same_file(src, reuse):
+            return False
+        try:
+            os.link(reuse, dst)
+        except OSError:
+            return False
+        return True
+
+    def _sync(self, src_dir, dst_dir, stats, reuse_dir=None):
+        """
+        让dst_dir与src_dir一致，只处理有差异的文件。
+
+        :param reuse_dir: 上一份快照中对应的目录，未变化的文件从这里硬链接，不再复制
+        """
+        os.makedirs(dst_dir, exist_ok=True)
+        src_names = set(os.listdir(src_dir))
+        for name in os.listdir(dst_dir):
+            if name not in src_names:
+                self._remove(os.path.join(dst_dir, name))
+                stats["removed"] += 1
+
+        for name in src_names:
+            src = os.path.join(src_dir, name)
+            dst = os.path.join(dst_dir, name)
+            reuse = os.path.join(reuse_dir, name) if reuse_dir is not None else None
+            if os.path.isdir(src) and not os.path.islink(src):
+                if os.path.lexists(dst) and (os.path.islink(dst) or not os.path.isdir(dst)):
+                    self._remove(dst)
+                self._sync(src, dst, stats, reuse)
+                continue
+            if self._same_file(src, dst):
+                stats["skipped"] += 1
+                continue
+            if os.path.lexists(dst):
+                # 先删除再写入，不能原地覆盖与快照共享inode的文件
+                self._remove(dst)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+                stats["copied"] += 1
+            elif self._reuse(src, reuse, dst):
+                stats["reused"] += 1
+            else:
+                stats[self._link_or_copy(src, dst)] += 1
+
+    def save(self, work_dir, store_dir):
+        """
+        把工作目录保存为快照。新快照先写入临时目录，完成后替换旧快照；
+        与旧快照相同的文件直接链接旧快照中的副本，只有变化的文件才复制。
+
+        :param work_dir: px4工作目录
+        :param store_dir: 快照目录
+        :return: 统计信息 {linked, reused, copied, skipped, removed, seconds}
+        """
+        start_time = time.perf_counter()
+        stats = {"linked": 0, "reused": 0, "copied": 0, "skipped": 0, "removed": 0}
+        store_dir = store_dir.rstrip("/")
+        self._take_ownership(work_dir)
+        self._take_ownership(store_dir)
+        new_dir = f"{store_dir}.new"
+        if os.path.lexists(new_dir):
+            shutil.rmtree(new_dir)
+        self._sync(work_dir, new_dir, stats, store_dir if os.path.isdir(store_dir) else None)
+        old_dir = f"{store_dir}.old"
+        if os.path.lexists(store_dir):
+            os.rename(store_dir, old_dir)
+        os.rename(new_dir, store_dir)
+        if os.path.lexists(old_dir):
+            shutil.rmtree(old_dir)
+        stats["seconds"] = time.perf_counter() - start_time
+        return stats
+
+    def recover(self, store_dir, work_dir):
+        """
+        把工作目录恢复为快照的内容，只重新链接或复制发生变化的文件。
+
+        :param store_dir: 快照目录
+        :param work_dir: px4工作目录
+        :return: 统计信息 {linked, reused, copied, skipped, removed, seconds}
+        """
+        start_time = time.perf_counter()
+        stats = {"linked": 0, "reused": 0, "copied": 0, "skipped": 0, "removed": 0}
+        self._take_ownership(store_dir)
+        self._take_ownership(work_dir)
+        self._sync(store_dir, work_dir, stats)
+        stats["seconds"] = time.perf_counter() - start_time
+        return stats
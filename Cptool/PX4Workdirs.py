@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+
+class PX4Workdirs:
+    """
+    由共享模板生成px4实例工作目录。
+
+    模板目录由一个启动过的实例目录生成（seed），之后每个实例目录由模板生成：
+    px4会原地修改的文件（参数、dataman、eeprom）逐个复制，其余文件硬链接，符号链接按原样重建，
+    全部在本进程中完成，不为每个实例启动shell。模板记录生成时的px4编译版本，版本变化后需重新生成。
+    清理时先把整个实例目录改名（瞬间完成），再在后台线程中删除，解释器退出前会等待删除完成。
+    """
+
+    # px4运行时会原地写入的文件和目录，不能在实例之间共享
+    MUTABLE = ("parameters.bson", "parameters_backup.bson", "dataman", "eeprom")
+    # 不放入模板的运行产物
+    EXCLUDE = ("log", "out.log")
+    # 模板目录中记录编译版本和是否已由实例目录生成的文件，不复制到实例目录
+    MARKER = ".template.json"
+
+    def __init__(self, px4_working_dir, template_dir=None, mutable=MUTABLE, build_id=None):
+        """
+        :param px4_working_dir: px4工作目录，实例目录为 instance_dir/instance_N
+        :param template_dir: 模板目录，默认为 {px4_working_dir}_template（不随工作目录一起删除）
+        :param mutable: 需要逐实例复制的文件或目录名
+        :param build_id: px4编译版本标识，与模板记录的不一致时模板失效
+        """
+        self.px4_working_dir = px4_working_dir.rstrip("/")
+        self.instances_dir = f"{self.px4_working_dir}/instance_dir"
+        self.template_dir = template_dir or f"{self.px4_working_dir}_template"
+        self.mutable = tuple(mutable)
+        self.build_id = build_id
+        self.cleanup_threads = []
+
+    def instance_dir(self, instance_num):
+        return f"{self.instances_dir}/instance_{instance_num}"
+
+    def build_template(self, seed_dir=None):
+        """
+        生成模板目录。
+
+        :param seed_dir: 已运行过的实例目录，其中的默认参数、dataman等作为模板内容；
+                         为None时生成只含 log、eeprom 目录的模板，dataman由px4首次启动时创建
+        """
+        shutil.rmtree(self.template_dir, ignore_errors=True)
+        if seed_dir is not None:
+            shutil.copytree(seed_dir, self.template_dir, symlinks=True, ignore=shutil.ignore_patterns(*self.EXCLUDE))
+        else:
+            os.makedirs(f"{self.template_dir}/eeprom")
+        os.makedirs(f"{self.template_dir}/log", exist_ok=True)
+        with open(f"{self.template_dir}/{self.MARKER}", "w") as f:
+            json.dump({"build": self.build_id, "seeded": seed_dir is not None}, f)
+
+    def _template_info(self):
+        try:
+            with open(f"{self.template_dir}/{self.MARKER}", "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def template_ready(self):
+        """模板是否已由实例目录生成，且与当前编译版本一致"""
+        info = self._template_info()
+        return info is not None and info.get("seeded", False) and info.get("build") == self.build_id
+
+    def seed_ready(self, instance_num):
+        """实例是否已写出默认参数和dataman，可以作为模板"""
+        instance_dir = self.instance_dir(instance_num)
+        return all(os.path.exists(f"{instance_dir}/{name}") for name in ("parameters.bson", "dataman"))
+
+    def _stamp(self, src_dir, dst_dir, mutable):
+        os.mkdir(dst_dir)
+        with os.scandir(src_dir) as entries:
+            for entry in entries:
+                if entry.name == self.MARKER:
+                    continue
+                src = entry.path
+                dst = os.path.join(dst_dir, entry.name)
+                is_mutable = mutable or entry.name in self.mutable
+                if entry.is_symlink():
+                    os.symlink(os.readlink(src), dst)
+                elif entry.is_dir():
+                    self._stamp(src, dst, is_mutable)
+                elif is_mutable:
+                    shutil.copyfile(src, dst)
+                else:
+                    os.link(src, dst)
+
+    def provision(self, instances):
+        """
+        为一组实例生成工作目录，已存在的目录先移走。
+
+        :param instances: PX4实例编号列表
+        :return: 耗时（秒）
+        """
+        start_time = time.perf_counter()
+        info = self._template_info()
+        if info is None or info.get("build") != self.build_id:
+            # 没有模板或编译版本已变化，先用空模板，实例启动后再由 build_template(seed_dir) 生成
+            self.build_template()
+        os.makedirs(self.instances_dir, exist_ok=True)
+        stale = [instance_num for instance_num in instances if os.path.lexists(self.instance_dir(instance_num))]
+        if stale:
+            trash_dir = self._trash_dir()
+            os.makedirs(trash_dir)
+            for instance_num in stale:
+                os.rename(self.instance_dir(instance_num), f"{trash_dir}/instance_{instance_num}")
+            self._remove_later(trash_dir)
+        for instance_num in instances:
+            self._stamp(self.template_dir, self.instance_dir(instance_num), False)
+        return time.perf_counter() - start_time
+
+    def _trash_dir(self):
+        return f"{self.px4_working_dir}.trash.{os.getpid()}.{time.time_ns()}"
+
+    def _remove_later(self, path):
+        # 非守护线程，解释器退出前会等待删除完成，不在内存盘上留下 .trash 目录
+        thread = threading.Thread(target=shutil.rmtree, args=(path,), kwargs={"ignore_errors": True})
+        thread.start()
+        self.cleanup_threads.append(thread)
+
+    def cleanup(self):
+        """把整个工作目录改名后在后台删除，调用返回时原路径已可重新使用"""
+        if os.path.lexists(self.px4_working_dir):
+            trash_dir = self._trash_dir()
+            os.rename(self.px4_working_dir, trash_dir)
+            self._remove_later(trash_dir)
+
+    def wait_cleanup(self):
+        """等待后台删除完成"""
+        for thread in self.cleanup_threads:
+            thread.join()
+        self.cleanup_threads = []